@@ -13,6 +13,7 @@ from flask import Flask, jsonify, send_from_directory, request
 from flask_cors import CORS
 import requests
 import tensorflow as tf
+from orb_hamming import HammingLSH, PackedDescriptors, cross_check_match
 
 
 app = Flask(__name__)
@@ -25,6 +26,9 @@ cnn_model = tf.keras.models.load_model(MODEL_PATH)
 orb = cv2.ORB_create(nfeatures=10000)
 bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
 MATCH_THRESHOLD = 10  # Lower means stricter matching
+# Matching backend for find_best_match: "bf" compares every registry image, "lsh" only the top-voted ones
+MATCHING_BACKEND = os.getenv('MATCHING_BACKEND', 'bf')
+LSH_CANDIDATES = int(os.getenv('LSH_CANDIDATES', '10'))
 HLS_CLEANUP_DIR = '/var/hls'
 HLS_CLEANED = False
 if not HLS_CLEANED and os.path.exists(HLS_CLEANUP_DIR):
@@ -82,11 +86,46 @@ def remove_green_border(image):
         return image[y:y+h, x:x+w]
     return image
 
+# Registry ORB descriptors and their LSH index, rebuilt when DATABASE_PATH changes
+lsh_registry = {'key': None, 'names': [], 'packed': None, 'lsh': None}
+
+def load_lsh_registry():
+    files = sorted(f for f in os.listdir(DATABASE_PATH) if f.endswith((".jpg", ".png", ".jpeg")))
+    key = tuple((f, os.path.getmtime(os.path.join(DATABASE_PATH, f))) for f in files)
+    if key != lsh_registry['key']:
+        names, descriptor_sets = [], []
+        for filename in files:
+            db_img = cv2.imread(os.path.join(DATABASE_PATH, filename), cv2.IMREAD_GRAYSCALE)
+            if db_img is None:
+                continue
+            _, des_db = orb.detectAndCompute(db_img, None)
+            names.append(filename)
+            descriptor_sets.append(des_db)
+        packed = PackedDescriptors(descriptor_sets)
+        lsh_registry.update(key=key, names=names, packed=packed, lsh=HammingLSH(packed))
+    return lsh_registry
+
+def find_best_match_lsh(des_query):
+    # Only the registry images sharing the most LSH buckets with the query are cross-checked
+    registry = load_lsh_registry()
+    candidates = registry['lsh'].candidates(des_query, LSH_CANDIDATES)
+    if len(candidates) == 0:
+        return None
+    owner_descriptors, seg_offsets = registry['packed'].gather(candidates)
+    pet_of_match, distances = cross_check_match(des_query, owner_descriptors, seg_offsets)
+    counts = np.bincount(pet_of_match, minlength=len(candidates))
+    sums = np.bincount(pet_of_match, weights=distances, minlength=len(candidates))
+    scores = np.where(counts > 0, sums / np.maximum(counts, 1), np.inf)
+    best = int(np.argmin(scores))
+    return registry['names'][candidates[best]] if scores[best] < MATCH_THRESHOLD else None
+
 def find_best_match(query_img):
     # Compares detected animal image to known database using ORB feature descriptors
     kp_query, des_query = orb.detectAndCompute(query_img, None)
     if des_query is None:
         return None
+    if MATCHING_BACKEND == 'lsh':
+        return find_best_match_lsh(des_query)
     best_match, best_score = None, float("inf")
     for filename in os.listdir(DATABASE_PATH):
         if filename.endswith((".jpg", ".png", ".jpeg")):
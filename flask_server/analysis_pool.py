@@ -0,0 +1,142 @@
+"""
+Bounded worker pool for per-animal analysis (classification and owner matching).
+
+Every camera thread used to start a new thread per finished track, so a busy
+scene or several cameras at once could pile up any number of concurrent
+classify_and_match calls. Jobs now go into one bounded priority queue served
+by a fixed number of worker threads. Higher-priority jobs (confident
+detections with large crops) are analysed first, and when the queue is full
+the shedding policy decides which job is dropped:
+  - "drop_lowest": the lowest-priority job (queued or new) is dropped
+  - "reject_new": the new job is dropped
+  - "block": the caller waits up to `block_timeout` seconds for room, then the new job is dropped
+
+The worker threads start on the first submit(), so a pool created at import
+time leaves the process single-threaded until a job arrives.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+SHED_POLICIES = ('drop_lowest', 'reject_new', 'block')
+
+
+class AnalysisPool:
+    """Fixed-size thread pool over a bounded priority queue"""
+
+    def __init__(self, fn, workers=2, max_queue=32, policy='drop_lowest', block_timeout=1.0, name="analysis"):
+        """
+        Args:
+            fn: called as fn(*args) for every job by a worker thread
+            workers: number of worker threads
+            max_queue: most jobs waiting to be analysed
+            policy: what to shed when the queue is full, one of SHED_POLICIES
+            block_timeout: seconds submit() waits for room with the "block" policy
+        """
+        if policy not in SHED_POLICIES:
+            raise ValueError(f"Unknown shedding policy '{policy}', expected one of: {', '.join(SHED_POLICIES)}")
+        self.fn = fn
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.heap = []  # (-priority, sequence, enqueue time, args)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self.busy = 0
+        self.max_depth = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0  # Of the completed (successful) jobs
+
+        self.workers = workers
+        self.name = name
+        self.threads = []
+
+    def submit(self, priority, *args):
+        """
+        Queue fn(*args) with the given priority (higher runs first).
+
+        Returns False if this job was shed. With "drop_lowest" a queued
+        lower-priority job may be shed in its place, and True is returned.
+        """
+        with self.lock:
+            if not self.threads:
+                self.threads = [threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                                for i in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+            self.submitted += 1
+            if len(self.heap) >= self.max_queue:
+                if self.policy == 'block':
+                    self.not_full.wait_for(lambda: len(self.heap) < self.max_queue, self.block_timeout)
+                elif self.policy == 'drop_lowest':
+                    lowest = max(range(len(self.heap)), key=lambda i: self.heap[i][:2])
+                    if -self.heap[lowest][0] < priority:
+                        self.heap[lowest] = self.heap[-1]
+                        self.heap.pop()
+                        heapq.heapify(self.heap)
+                        self.shed += 1
+            if len(self.heap) >= self.max_queue:
+                self.shed += 1
+                return False
+
+            heapq.heappush(self.heap, (-priority, next(self.sequence), time.monotonic(), args))
+            self.max_depth = max(self.max_depth, len(self.heap))
+            self.not_empty.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self.lock:
+                self.not_empty.wait_for(lambda: self.heap)
+                _, _, enqueued, args = heapq.heappop(self.heap)
+                waited = time.monotonic() - enqueued
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+                self.started += 1
+                self.busy += 1
+                self.not_full.notify()
+
+            start = time.perf_counter()
+            try:
+                self.fn(*args)
+                failed = False
+            except Exception as e:
+                print(f"Analysis job failed: {e}")
+                failed = True
+
+            with self.lock:
+                self.busy -= 1
+                # Failed jobs are counted on their own and left out of the run time average
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                    self.run_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'busy': self.busy,
+                'queue_depth': len(self.heap),
+                'max_queue_depth': self.max_depth,
+                'queue_size': self.max_queue,
+                'policy': self.policy,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'shed': self.shed,
+                'avg_wait_ms': self.wait_seconds / self.started * 1000 if self.started else 0.0,
+                'max_wait_ms': self.max_wait_seconds * 1000,
+                'avg_run_ms': self.run_seconds / self.completed * 1000 if self.completed else 0.0
+            }
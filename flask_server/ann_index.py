@@ -0,0 +1,138 @@
+"""
+Approximate nearest-neighbour search over owner embeddings (IVF-flat, NumPy only).
+
+The registry embeddings are clustered with spherical k-means into `nlist`
+inverted lists. A query is compared against the centroids first and then
+only against the vectors stored in its `nprobe` closest lists, so the cost
+per query drops from N to roughly N * nprobe / nlist dot products.
+
+`nprobe` is the recall/latency knob: nprobe == nlist is an exact search,
+smaller values are faster with lower recall. See bench_embedding_search.py.
+
+By default the vectors are copied, grouped by list, so every probe reads one
+contiguous slice. With `shared=True` (a memory-mapped matrix shared between
+worker processes) only the row ids are kept and the probed rows are gathered
+from the shared matrix at query time, so no process holds a private copy.
+"""
+import numpy as np
+
+from owner_index import normalize_rows
+
+# Rows scored per block when assigning vectors to lists, keeps peak memory bounded
+ASSIGN_CHUNK = 8192
+
+
+def _assign(vectors, centroids):
+    """Index of the closest (highest cosine) centroid for every row"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        assignments[start:start + ASSIGN_CHUNK] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors, nlist, n_iter=20, max_train=None, seed=0):
+    """Spherical k-means on (a sample of) the normalized vectors"""
+    rng = np.random.default_rng(seed)
+    max_train = max_train or nlist * 64
+    if len(vectors) > max_train:
+        train = vectors[rng.choice(len(vectors), max_train, replace=False)]
+    else:
+        train = vectors
+
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, train)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        # Re-seed empty lists with random training points so no list is wasted
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    """
+    Inverted-file index with exact (flat) scoring inside each probed list.
+
+    Exposes the same search/search_batch interface as EmbeddingMatrix so the
+    matcher can use either one.
+    """
+
+    def __init__(self, embeddings, nlist=None, nprobe=8, n_iter=20, seed=0, shared=False):
+        """
+        Args:
+            embeddings: EmbeddingMatrix to index (rows are already normalized)
+            nlist: number of inverted lists, defaults to sqrt(N)
+            nprobe: number of lists scanned per query
+            n_iter: k-means iterations
+            seed: random seed for k-means initialisation
+            shared: keep row ids into embeddings.matrix instead of a grouped copy of the vectors
+        """
+        matrix = embeddings.matrix
+        count = len(embeddings)
+        self.filenames = embeddings.filenames
+        self.nlist = min(nlist or max(1, int(np.sqrt(count))), max(count, 1))
+        self.nprobe = nprobe
+        self.matrix = matrix if shared else None
+
+        if count == 0:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+            self.vectors = matrix
+            self.ids = np.zeros(0, dtype=np.int64)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+
+        self.centroids = train_centroids(matrix, self.nlist, n_iter=n_iter, seed=seed)
+        assignments = _assign(matrix, self.centroids)
+
+        # Store the vectors grouped by list so each probe reads one contiguous slice
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = None if shared else np.ascontiguousarray(matrix[order])
+        self.ids = order
+        self.offsets = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def keys(self):
+        return list(self.filenames)
+
+    def search(self, query, k=5, nprobe=None):
+        """Return the k most similar owners as [(filename, cosine_similarity), ...], best first"""
+        return self.search_batch(np.asarray(query)[None, :], k, nprobe)[0]
+
+    def search_batch(self, queries, k=5, nprobe=None):
+        """Search many query embeddings; nprobe overrides the index default for this call"""
+        queries = np.asarray(queries)
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        queries = normalize_rows(queries)
+        centroid_sims = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_sims, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, lists in zip(queries, probes):
+            # Each list is a contiguous slice, so scoring it is a plain matrix-vector product on a view
+            spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists if self.offsets[l + 1] > self.offsets[l]]
+            if not spans:
+                results.append([])
+                continue
+
+            rows = np.concatenate([self.ids[start:end] for start, end in spans])
+            if self.vectors is None:
+                sims = self.matrix[rows] @ query
+            else:
+                sims = np.concatenate([self.vectors[start:end] @ query for start, end in spans])
+            top_k = min(k, len(rows))
+            top = np.argpartition(-sims, top_k - 1)[:top_k]
+            top = top[np.argsort(-sims[top])]
+            results.append([(self.filenames[rows[i]], float(sims[i])) for i in top])
+        return results
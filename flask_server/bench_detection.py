@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Benchmark RT-DETR throughput per camera at several inference resolutions
+#
+# Frames from a sample video are resized to the camera frame size
+# (FRAME_WIDTH x FRAME_HEIGHT in besttrial.py) and detected in batches of
+# --cameras frames, the way the detector worker batches one frame per
+# stream. For each resolution the script reports the batch latency, the
+# total frames per second and the frames per second left for each camera,
+# plus the dog/cat detections per frame above the server's 0.6 confidence,
+# to show what a lower resolution costs in recall.
+#
+# Usage:
+#   python bench_detection.py                                   # auto device, onnx export on CPU
+#   python bench_detection.py --device cpu --format openvino --resolutions 960x544 640x352 480x256
+#   python bench_detection.py --video sample_video2.avi --cameras 11
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from detection_backend import CPU_FORMATS, DEVICES, DetectionBackend, parse_resolution
+
+FRAME_WIDTH, FRAME_HEIGHT = 960, 544
+DOG_CLASS_ID, CAT_CLASS_ID = 1, 0
+CONFIDENCE = 0.6
+
+
+def read_frames(path, count):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            if not frames:
+                break
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT)))
+    cap.release()
+    return frames
+
+
+def count_detections(results):
+    count = 0
+    for result in results:
+        for box in result.boxes:
+            if int(box.cls.item()) in (DOG_CLASS_ID, CAT_CLASS_ID) and box.conf.item() > CONFIDENCE:
+                count += 1
+    return count
+
+
+def bench(backend, frames, cameras, warmup):
+    batches = [frames[i:i + cameras] for i in range(0, len(frames) - cameras + 1, cameras)]
+    for batch in batches[:warmup]:
+        backend.predict(batch)
+
+    latencies, detections, processed = [], 0, 0
+    for batch in batches[warmup:]:
+        start = time.perf_counter()
+        results = backend.predict(batch)
+        latencies.append(time.perf_counter() - start)
+        detections += count_detections(results)
+        processed += len(batch)
+
+    total = sum(latencies)
+    return {
+        'batch_ms': float(np.median(latencies)) * 1000,
+        'fps': processed / total if total else 0.0,
+        'fps_per_camera': processed / total / cameras if total else 0.0,
+        'detections_per_frame': detections / processed if processed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RT-DETR FPS per camera at several resolutions")
+    parser.add_argument('--weights', default="best.pt")
+    parser.add_argument('--video', default="sample_video.avi", help="Source of the benchmark frames")
+    parser.add_argument('--resolutions', nargs='+', default=['960x544', '800x448', '640x352', '480x256'],
+                        help="Inference resolutions as WIDTHxHEIGHT (multiples of 32)")
+    parser.add_argument('--device', default='auto', choices=DEVICES)
+    parser.add_argument('--format', default='onnx', choices=CPU_FORMATS, help="Engine used without CUDA")
+    parser.add_argument('--cameras', type=int, default=8, help="Frames per batch, one per camera")
+    parser.add_argument('--batches', type=int, default=20, help="Timed batches per resolution")
+    parser.add_argument('--warmup', type=int, default=2)
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.cameras * (args.batches + args.warmup))
+    if len(frames) < args.cameras * (args.warmup + 1):
+        print(f"Could not read enough frames from {args.video}")
+        return
+
+    print(f"{'resolution':<12}{'device':>8}{'engine':>10}{'batch ms':>10}{'FPS':>8}{'FPS/cam':>9}{'dets/frame':>12}")
+    for value in args.resolutions:
+        backend = DetectionBackend(args.weights, parse_resolution(value), args.device, args.format)
+        r = bench(backend, frames, args.cameras, args.warmup)
+        print(f"{value:<12}{backend.device:>8}{backend.engine:>10}{r['batch_ms']:>10.1f}{r['fps']:>8.1f}"
+              f"{r['fps_per_camera']:>9.2f}{r['detections_per_frame']:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Benchmark exact vs IVF (approximate) owner embedding search
+#
+# Compares the exact matrix search used by match_snapshot_to_owner with the
+# IVF-flat index for several nprobe values and reports recall@k against the
+# exact results together with the per-query latency.
+#
+# Usage:
+#   python bench_embedding_search.py                      # synthetic 50k x 2048 registry
+#   python bench_embedding_search.py --size 100000 --nprobe 1 4 8 16 32
+#   python bench_embedding_search.py --embeddings owner_embeddings.npy
+
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import IVFFlatIndex
+from owner_index import EmbeddingMatrix
+
+
+def synthetic_embeddings(size, dim, clusters, seed=0):
+    """Clustered non-negative vectors, roughly shaped like pooled ResNet50 features"""
+    rng = np.random.default_rng(seed)
+    centers = rng.gamma(1.0, 1.0, size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=size)
+    noise = rng.gamma(1.0, 0.5, size=(size, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def time_search(search_fn, queries, k):
+    start = time.perf_counter()
+    results = [search_fn(q, k) for q in queries]
+    elapsed = time.perf_counter() - start
+    return results, elapsed / len(queries) * 1000
+
+
+def recall_at_k(exact_results, approx_results):
+    hits = 0
+    total = 0
+    for exact, approx in zip(exact_results, approx_results):
+        exact_names = {name for name, _ in exact}
+        hits += len(exact_names & {name for name, _ in approx})
+        total += len(exact_names)
+    return hits / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact vs IVF owner embedding search")
+    parser.add_argument('--embeddings', help=".npy file of registry embeddings (overrides --size/--dim)")
+    parser.add_argument('--size', type=int, default=50000, help="Number of synthetic registry embeddings")
+    parser.add_argument('--dim', type=int, default=2048, help="Embedding dimension")
+    parser.add_argument('--clusters', type=int, default=500, help="Clusters in the synthetic data")
+    parser.add_argument('--queries', type=int, default=200, help="Number of queries")
+    parser.add_argument('--k', type=int, default=10, help="Neighbours per query")
+    parser.add_argument('--nlist', type=int, default=0, help="IVF lists, 0 means sqrt(size)")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings, mmap_mode='r').astype(np.float32)
+    else:
+        vectors = synthetic_embeddings(args.size, args.dim, args.clusters)
+
+    rng = np.random.default_rng(1)
+    # Queries are perturbed registry entries, like a new photo of a registered pet
+    picks = rng.choice(len(vectors), args.queries, replace=False)
+    queries = vectors[picks] + rng.normal(0, 1.0, size=(args.queries, vectors.shape[1])).astype(np.float32)
+
+    filenames = [f"pet_{i}.jpg" for i in range(len(vectors))]
+    exact = EmbeddingMatrix(filenames, vectors)
+    print(f"Registry: {len(exact)} embeddings x {exact.matrix.shape[1]} dims, {args.queries} queries, k={args.k}")
+
+    exact_results, exact_ms = time_search(exact.search, queries, args.k)
+    print(f"{'method':<16}{'recall@k':>10}{'ms/query':>12}{'speedup':>10}")
+    print(f"{'exact':<16}{1.0:>10.3f}{exact_ms:>12.3f}{1.0:>10.1f}")
+
+    start = time.perf_counter()
+    ivf = IVFFlatIndex(exact, nlist=args.nlist or None)
+    print(f"(IVF build with {ivf.nlist} lists took {time.perf_counter() - start:.1f}s)")
+
+    for nprobe in args.nprobe:
+        if nprobe > ivf.nlist:
+            continue
+        results, ms = time_search(lambda q, k: ivf.search(q, k, nprobe=nprobe), queries, args.k)
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall_at_k(exact_results, results):>10.3f}{ms:>12.3f}{exact_ms / ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
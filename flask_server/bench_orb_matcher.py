@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# Benchmark the ORB matchers of the owner-matching ORB stage
+#
+# Random 256-bit descriptors stand in for a query crop and the color
+# survivors' registry photos. "bf" is cv2.BFMatcher(NORM_HAMMING,
+# crossCheck=True) run pet by pet, as with ORB_MATCHER=bf; "packed" is
+# orb_hamming.cross_check_match over all survivors at once. Both are checked
+# to find the same matches, and the time per query is reported for each.
+#
+# Usage:
+#   python bench_orb_matcher.py
+#   python bench_orb_matcher.py --query 2000 --pets 50 --descriptors 2000 --threads 1
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from orb_hamming import DESCRIPTOR_BYTES, cross_check_match
+
+
+def bf_matches(bf, query, pets):
+    matched = []
+    for pet, descriptors in enumerate(pets):
+        for m in bf.match(query, descriptors):
+            matched.append((pet, m.queryIdx, m.trainIdx, int(m.distance)))
+    return sorted(matched)
+
+
+def packed_matches(query, pets):
+    seg_offsets = np.concatenate([[0], np.cumsum([len(d) for d in pets])]).astype(np.int64)
+    owner = np.vstack(pets)
+    pet_of_match, distances = cross_check_match(query, owner, seg_offsets)
+    return pet_of_match, distances
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cv2.BFMatcher and the packed NumPy ORB matcher")
+    parser.add_argument('--query', type=int, default=1000, help="Query descriptors")
+    parser.add_argument('--pets', type=int, default=50, help="Candidate registry photos (color survivors)")
+    parser.add_argument('--descriptors', type=int, default=1000, help="Descriptors per registry photo")
+    parser.add_argument('--threads', type=int, default=0, help="OpenCV threads, 0 keeps the default")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.threads:
+        cv2.setNumThreads(args.threads)
+    rng = np.random.default_rng(0)
+    query = rng.integers(0, 256, (args.query, DESCRIPTOR_BYTES), dtype=np.uint8)
+    pets = [rng.integers(0, 256, (args.descriptors, DESCRIPTOR_BYTES), dtype=np.uint8) for _ in range(args.pets)]
+
+    bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    expected, bf_seconds = timed(lambda: bf_matches(bf, query, pets), args.repeat)
+    (pet_of_match, distances), packed_seconds = timed(lambda: packed_matches(query, pets), args.repeat)
+
+    per_pet = {}
+    for pet, _, _, distance in expected:
+        per_pet.setdefault(pet, []).append(distance)
+    got = {}
+    for pet, distance in zip(pet_of_match.tolist(), distances.tolist()):
+        got.setdefault(pet, []).append(distance)
+    same = {p: sorted(d) for p, d in per_pet.items()} == {p: sorted(d) for p, d in got.items()}
+
+    print(f"{args.query} query x {args.pets} pets x {args.descriptors} descriptors, "
+          f"{len(expected)} cross-checked matches, same matches: {same}")
+    print(f"{'matcher':<10}{'ms/query':>12}")
+    print(f"{'bf':<10}{bf_seconds * 1000:>12.1f}")
+    print(f"{'packed':<10}{packed_seconds * 1000:>12.1f}")
+    print(f"packed speedup: {bf_seconds / packed_seconds:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import cv2
-import torch
+import fcntl
 import time
 import base64
 import threading
@@ -7,29 +7,127 @@ import subprocess
 import os
 import numpy as np
 import shutil
+import sys
+import uuid
 from collections import deque, defaultdict
-from ultralytics import RTDETR
-from flask import Flask, jsonify, send_from_directory, request
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, jsonify, send_from_directory, request, stream_with_context
 from flask_cors import CORS
 import requests
-import tensorflow as tf
-from keras.applications.resnet50 import ResNet50, preprocess_input
-from keras.models import Model
-from sklearn.metrics.pairwise import cosine_similarity
 from datetime import datetime
 import json
+from ann_index import IVFFlatIndex
+from detection_backend import DetectionBackend, parse_resolution, result_boxes
+from embedding_backends import EmbeddingBackend
+from onnx_models import load_onnx_model
+from match_pool import MatchPool
+from pet_gallery import PetGallery, PetIds
+from orb_hamming import HammingLSH, cross_check_match, summarize_matches
+from micro_batcher import MicroBatcher
+from motion_gate import MotionGate
+from keyframe_tracker import KeyframeTracker
+from detection_cache import DetectionCache
+from model_loader import ModelLoader
+from analysis_pool import AnalysisPool
+from result_cache import MatchResultCache
+from owner_index_file import file_stamp, load_owner_index, save_owner_index
+from owner_index import SPECIES, EmbeddingCache, EmbeddingMatrix, OwnerIndex, SpeciesLabels, build_owner_index, update_owner_index, compute_color_histogram, compute_orb_features, correlation_rows
 
 
 app = Flask(__name__)
 CORS(app)
 # --- CNN and ORB Feature Matcher Setup ---
-tf.config.set_visible_devices([], 'GPU')
 MODEL_PATH = "model.h5"
 DATABASE_PATH = "/home/straysafe/venv/with_leash"
-cnn_model = tf.keras.models.load_model(MODEL_PATH)
+# Embedding backbone: resnet50, mobilenet_v3_small, mobilenet_v3_large or efficientnet_b0
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'resnet50')
+# Runtime for model.h5 and the embedding backbone: "tf" (Keras), "onnx" (ONNX Runtime on CPU) or "onnx-int8"
+# (the INT8 models made by quantize_models.py). ONNX exports are written to ONNX_MODEL_DIR on first use and
+# re-exported when model.h5 changes
+INFERENCE_RUNTIME = os.getenv('INFERENCE_RUNTIME', 'tf')
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', os.path.join("venv", "onnx"))
+ONNX_THREADS = int(os.getenv('ONNX_THREADS', '0'))  # Intra-op threads per ONNX model, 0 uses every core available
+# Quantized embeddings differ slightly from the float model's, so they are cached and indexed separately
+EMBEDDING_KEY = f"{EMBEDDING_BACKEND}-int8" if INFERENCE_RUNTIME == 'onnx-int8' else EMBEDDING_BACKEND
+# Registry embeddings are persisted here between restarts, in a sub-directory per backend;
+# set to an empty string to disable
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', os.path.join("venv", "embedding_cache"))
+# Memory-mapped owner index shared by all worker processes; empty keeps the index in process memory.
+# The backend name is added to the file name, since the index holds that backend's embeddings
+OWNER_INDEX_FILE = os.getenv('OWNER_INDEX_FILE', '')
+if OWNER_INDEX_FILE:
+    _index_base, _index_ext = os.path.splitext(OWNER_INDEX_FILE)
+    OWNER_INDEX_FILE = f"{_index_base}-{EMBEDDING_KEY}{_index_ext}"
+# How often (seconds) DATABASE_PATH is scanned for new, changed or removed registrations
+REGISTRY_POLL_INTERVAL = float(os.getenv('REGISTRY_POLL_INTERVAL', '10'))
+# {filename: "dog" | "cat"} for the registry images; unlabelled images are labelled once by the detector
+SPECIES_METADATA = os.getenv('SPECIES_METADATA', os.path.join(DATABASE_PATH, "species.json"))
+# Match only against pets of the detected species (set to 0 to search the whole registry)
+MATCH_BY_SPECIES = os.getenv('MATCH_BY_SPECIES', '1') == '1'
+# How models are loaded: "parallel" (background thread per model at startup), "sequential" (one background
+# thread) or "lazy" (on first use). Cameras and HLS start immediately; see /api2/health/ready
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'parallel')
 orb = cv2.ORB_create(nfeatures=10000)
 bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
 MATCH_THRESHOLD = 10  # Lower means stricter matching
+EMBEDDING_TOP_K = 10  # Number of nearest owner embeddings considered by the CNN fallback
+# Embedding search backend: "exact" (full matrix product) or "ivf" (approximate, for large registries)
+EMBEDDING_SEARCH = os.getenv('EMBEDDING_SEARCH', 'exact')
+ANN_MIN_SIZE = int(os.getenv('ANN_MIN_SIZE', '5000'))  # Registries smaller than this always use exact search
+ANN_NLIST = int(os.getenv('ANN_NLIST', '0'))  # Number of IVF lists, 0 means sqrt(registry size)
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '8'))  # Lists scanned per query, higher is slower but more accurate
+# Cascaded matcher: pets kept after the color stage (0 keeps all) and score that ends the ORB stage early
+MATCH_COLOR_TOP_K = int(os.getenv('MATCH_COLOR_TOP_K', '50'))
+# Group registry photos by pet and compare against one prototype per pet first (0 compares every photo)
+MATCH_PROTOTYPES = os.getenv('MATCH_PROTOTYPES', '1') == '1'
+PET_EXEMPLARS = int(os.getenv('PET_EXEMPLARS', '3'))  # Diverse photos per pet compared once its prototype is close
+# {filename: pet_id} grouping registry photos by pet for MATCH_PROTOTYPES; unlisted photos are one pet each
+PET_METADATA = os.getenv('PET_METADATA', os.path.join(DATABASE_PATH, "pets.json"))
+MATCH_EARLY_EXIT_SCORE = float(os.getenv('MATCH_EARLY_EXIT_SCORE', '0.9'))
+# ORB matcher: "bf" uses cv2.BFMatcher per pet and can stop at the first confident match, "packed" scores all
+# candidates up front with NumPy XOR/popcount (compare them with bench_orb_matcher.py), "lsh" only verifies the
+# candidates that collect the most LSH votes
+ORB_MATCHER = os.getenv('ORB_MATCHER', 'bf')
+LSH_TABLES = int(os.getenv('LSH_TABLES', '8'))  # Hash tables, more tables means higher recall
+LSH_KEY_BITS = int(os.getenv('LSH_KEY_BITS', '16'))  # Descriptor bits sampled per table
+LSH_CANDIDATES = int(os.getenv('LSH_CANDIDATES', '10'))  # Top-voted pets passed to full ORB verification
+# Worker processes for the color/ORB stages (packed matcher only), 0 matches in the request thread
+MATCH_WORKERS = int(os.getenv('MATCH_WORKERS', '0'))
+MATCH_POOL_DIR = os.getenv('MATCH_POOL_DIR', os.path.join("venv", "match_pool"))
+MATCH_CACHE_SIZE = int(os.getenv('MATCH_CACHE_SIZE', '512'))  # Cached crop results, 0 disables the cache
+MATCH_CACHE_TTL = float(os.getenv('MATCH_CACHE_TTL', '600'))  # Seconds a cached result stays valid
+MATCH_CACHE_RADIUS = int(os.getenv('MATCH_CACHE_RADIUS', '6'))  # Max perceptual-hash bit difference for a cache hit
+MATCH_CACHE_HASH = os.getenv('MATCH_CACHE_HASH', 'phash')  # phash or dhash
+MATCH_BATCH_SIZE = int(os.getenv('MATCH_BATCH_SIZE', '32'))  # Crops matched together by /api2/match/batch
+CLASSIFY_BATCH_SIZE = int(os.getenv('CLASSIFY_BATCH_SIZE', '16'))  # Most crops per stray-classifier forward pass
+CLASSIFY_MAX_WAIT_MS = float(os.getenv('CLASSIFY_MAX_WAIT_MS', '20'))  # Wait for more crops after the first of a batch
+# All cameras' stray classifications go through one worker that batches them into single forward passes
+stray_classifier = MicroBatcher(lambda batch: models.get('classifier').predict(batch, verbose=0),
+                                CLASSIFY_BATCH_SIZE, CLASSIFY_MAX_WAIT_MS / 1000, name="stray-classifier")
+# /api2/match/batch crops that need the embedding stage are embedded together in one backbone call
+embedding_batcher = MicroBatcher(lambda imgs: get_image_embeddings(imgs),
+                                 MATCH_BATCH_SIZE, CLASSIFY_MAX_WAIT_MS / 1000, name="embedder", collate=list)
+DETECT_BATCH_SIZE = int(os.getenv('DETECT_BATCH_SIZE', '8'))  # Most camera frames per RT-DETR forward pass
+DETECT_MAX_WAIT_MS = float(os.getenv('DETECT_MAX_WAIT_MS', '10'))  # Wait for other cameras' frames after the first
+# Skip the detector on frames without motion: "diff" (running-average frame differencing), "mog2" or "off"
+MOTION_GATE = os.getenv('MOTION_GATE', 'diff')
+MOTION_THRESHOLD = float(os.getenv('MOTION_THRESHOLD', '0.002'))  # Fraction of changed pixels that counts as motion
+MOTION_PIXEL_DELTA = int(os.getenv('MOTION_PIXEL_DELTA', '25'))  # Gray-level change for a pixel to count ("diff")
+MOTION_MAX_SKIP_SECONDS = float(os.getenv('MOTION_MAX_SKIP_SECONDS', '5'))  # Detect at least this often regardless
+# Run the detector on every KEYFRAME_INTERVAL-th frame only (1 detects every frame) and move the last boxes in
+# between with BOX_PROPAGATION: "flow" (sparse optical flow) or "kalman" (constant-velocity filter per box)
+KEYFRAME_INTERVAL = int(os.getenv('KEYFRAME_INTERVAL', '1'))
+KEYFRAME_ADAPTIVE = os.getenv('KEYFRAME_ADAPTIVE', '0') == '1'  # Shorter intervals for fast or many animals
+KEYFRAME_MAX_INTERVAL = int(os.getenv('KEYFRAME_MAX_INTERVAL', '10'))  # Longest adaptive interval
+BOX_PROPAGATION = os.getenv('BOX_PROPAGATION', 'flow')
+# Keep the demo videos' detector boxes per (video hash, frame index, model) and replay them on later loops
+DETECTION_CACHE = os.getenv('DETECTION_CACHE', '1') == '1'
+DETECTION_CACHE_DIR = os.getenv('DETECTION_CACHE_DIR', os.path.join("venv", "detections"))
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '4'))  # Threads classifying and matching finished tracks
+ANALYSIS_QUEUE_SIZE = int(os.getenv('ANALYSIS_QUEUE_SIZE', '32'))  # Finished tracks waiting for a worker
+# What to shed when the queue is full: drop_lowest (lowest-priority track), reject_new or block
+ANALYSIS_SHED_POLICY = os.getenv('ANALYSIS_SHED_POLICY', 'drop_lowest')
+ANALYSIS_BLOCK_TIMEOUT = float(os.getenv('ANALYSIS_BLOCK_TIMEOUT', '1.0'))  # Seconds a camera thread waits with "block"
 HLS_CLEANUP_DIR = '/var/hls'
 HLS_CLEANED = False
 if not HLS_CLEANED and os.path.exists(HLS_CLEANUP_DIR):
@@ -42,10 +140,15 @@ os.makedirs(HLS_CLEANUP_DIR, exist_ok=True)
 os.chmod(HLS_CLEANUP_DIR, 0o777)
 HLS_CLEANED = True
 
-feature_extractor = ResNet50(weights='imagenet', include_top=False, pooling='avg')
-
 
 FRAME_WIDTH, FRAME_HEIGHT = 960, 544
+# RT-DETR device: "auto" uses CUDA when available and otherwise the DETECT_CPU_FORMAT engine (onnx, openvino or
+# pytorch); CPU exports of best.pt are made once per resolution in DETECT_EXPORT_DIR
+DETECT_DEVICE = os.getenv('DETECT_DEVICE', 'auto')
+DETECT_CPU_FORMAT = os.getenv('DETECT_CPU_FORMAT', 'onnx')
+DETECT_EXPORT_DIR = os.getenv('DETECT_EXPORT_DIR', os.path.join("venv", "detector"))
+# Inference resolution as WIDTHxHEIGHT (multiples of 32); below the frame size is faster, see bench_detection.py
+DETECT_RESOLUTION = parse_resolution(os.getenv('DETECT_RESOLUTION', f"{FRAME_WIDTH}x{FRAME_HEIGHT}"))
 REQUIRED_CONSECUTIVE_FRAMES = 20
 DOG_CLASS_ID = 1
 CAT_CLASS_ID = 0
@@ -60,11 +163,133 @@ STATIC_VIDEO_SOURCES = {
 
 stream_data = {}
 stream_threads = []
-model = RTDETR('best.pt')
-model.conf = 0.6
-model.to('cuda' if torch.cuda.is_available() else 'cpu')
+tensorflow_lock = threading.Lock()
+
+def import_tensorflow():
+    """Import TensorFlow on first use and keep it off the GPU, which RT-DETR uses"""
+    import tensorflow as tf
+    with tensorflow_lock:
+        if tf.config.get_visible_devices('GPU'):
+            tf.config.set_visible_devices([], 'GPU')
+    return tf
+
+def load_stray_classifier():
+    def load_keras_model():
+        return import_tensorflow().keras.models.load_model(MODEL_PATH)
+    if INFERENCE_RUNTIME in ('onnx', 'onnx-int8'):
+        return load_onnx_model(os.path.join(ONNX_MODEL_DIR, "model.onnx"), load_keras_model, ONNX_THREADS,
+                               source_path=MODEL_PATH, int8=INFERENCE_RUNTIME == 'onnx-int8')
+    return load_keras_model()
+
+def load_embedding_backend():
+    if INFERENCE_RUNTIME == 'tf':
+        import_tensorflow()
+    backend = EmbeddingBackend(EMBEDDING_BACKEND, INFERENCE_RUNTIME, ONNX_MODEL_DIR, ONNX_THREADS)
+    print(f"Embedding backend: {EMBEDDING_BACKEND} ({backend.dim}-d, {INFERENCE_RUNTIME})")
+    return backend
+
+def load_detector():
+    return DetectionBackend('best.pt', DETECT_RESOLUTION, DETECT_DEVICE, DETECT_CPU_FORMAT, DETECT_EXPORT_DIR)
+
+# Stray classifier (model.h5), embedding backbone and RT-DETR, loaded in the background (see MODEL_LOADING)
+models = ModelLoader(MODEL_LOADING)
+models.register('detector', load_detector)
+models.register('classifier', load_stray_classifier)
+models.register('embedder', load_embedding_backend)
+
+# Every stream's frames go through one worker that runs the cameras' current frames as one RT-DETR batch
+detection_batcher = MicroBatcher(
+    lambda frames: models.get('detector').predict(frames),
+    DETECT_BATCH_SIZE, DETECT_MAX_WAIT_MS / 1000, name="detector", collate=list)
+
+def detect(frame):
+    """RT-DETR results for one frame, computed in a batch with the other cameras' frames"""
+    return [detection_batcher.submit(frame).result()]
+
+# stream_id -> MotionGate, created on the stream's first frame
+motion_gates = {}
+
+def should_detect(stream_id, frame):
+    """Whether a stream's frame goes to the detector: once it has loaded, if the motion gate lets it through"""
+    if not models.is_ready('detector'):
+        return False
+    if MOTION_GATE == 'off':
+        return True
+    gate = motion_gates.get(stream_id)
+    if gate is None:
+        gate = motion_gates.setdefault(stream_id, MotionGate(MOTION_GATE, MOTION_THRESHOLD, MOTION_PIXEL_DELTA,
+                                                             MOTION_MAX_SKIP_SECONDS))
+    # Tracked animals may stand still, so they are always detected
+    has_tracks = any(stream_data[stream_id]['active_tracks'].values())
+    return gate.should_detect(frame, has_tracks)
+
+# stream_id -> KeyframeTracker, created on the stream's first frame
+keyframe_trackers = {}
+
+def frame_boxes(stream_id, frame, cache=None, frame_index=None):
+    """
+    (class_id, confidence, (x1, y1, x2, y2)) boxes for a stream's frame: from the detector on keyframes that
+    should_detect() lets through, otherwise the last keyframe's boxes moved to this frame, or carried forward
+    unchanged when the motion gate skips a static frame.
 
-owner_embeddings = {}
+    With a DetectionCache (demo videos), keyframes already cached are replayed instead of detected; new
+    detections and the carried-forward boxes of skipped frames are added to it under `frame_index`, so later
+    loops don't run the motion gate or the detector on those frames again.
+    """
+    keyframes = keyframe_trackers.get(stream_id)
+    if keyframes is None:
+        keyframes = keyframe_trackers.setdefault(stream_id, KeyframeTracker(KEYFRAME_INTERVAL, KEYFRAME_ADAPTIVE,
+                                                                            KEYFRAME_MAX_INTERVAL, BOX_PROPAGATION))
+    if not keyframes.is_keyframe():
+        return keyframes.propagate(frame)
+    boxes = cache.get(frame_index) if cache is not None else None
+    if boxes is not None:
+        keyframes.update(frame, boxes)
+        return boxes
+    if not should_detect(stream_id, frame):
+        # Still waiting for a keyframe, the next frame tries again; nothing moved, so the last boxes still hold
+        boxes = list(keyframes.boxes)
+        if cache is not None:
+            cache.put(frame_index, boxes)
+        return boxes
+    boxes = result_boxes(detect(frame))
+    keyframes.update(frame, boxes)
+    if cache is not None:
+        cache.put(frame_index, boxes)
+    return boxes
+
+# stream_id -> DetectionCache of a demo video, created once the detector has loaded (its weights are in the key)
+detection_caches = {}
+
+def video_detection_cache(stream_id, video_path):
+    """The demo stream's DetectionCache, or None while the detector is loading or with DETECTION_CACHE=0"""
+    if not DETECTION_CACHE:
+        return None
+    cache = detection_caches.get(stream_id)
+    if cache is None and models.is_ready('detector'):
+        cache = DetectionCache(DETECTION_CACHE_DIR, video_path, models.get('detector').cache_key())
+        detection_caches[stream_id] = cache
+    return cache
+
+owner_embeddings = EmbeddingMatrix()
+# Precomputed histogram/ORB/embedding features for every registered pet image
+owner_index = OwnerIndex(DATABASE_PATH)
+# Serializes index rebuilds; matches never take it, they just read the current owner_index reference
+owner_index_lock = threading.Lock()
+embedding_cache = EmbeddingCache(os.path.join(EMBEDDING_CACHE_DIR, EMBEDDING_KEY)) if EMBEDDING_CACHE_DIR else None
+species_labels = None  # SpeciesLabels of the registry, loaded by precompute_owner_embeddings
+pet_ids = PetIds(PET_METADATA)  # Pet of each registry photo, reloaded whenever the index is prepared
+owner_index_ready = False  # Set once the first owner index is installed, reported by /api2/health/ready
+owner_index_error = None  # Why the last owner index build failed, until an index is installed
+# Open lock file while this process is the one that builds and publishes OWNER_INDEX_FILE
+owner_index_builder = None
+# Running totals of the matcher's per-stage candidate counts and timings
+match_stage_stats = {'matches': 0, 'stages': {}}
+match_stats_lock = threading.Lock()
+# Classification/match results of recent crops, keyed by perceptual hash; cleared when owner_index changes
+match_cache = MatchResultCache(MATCH_CACHE_SIZE, MATCH_CACHE_TTL, MATCH_CACHE_RADIUS, MATCH_CACHE_HASH) if MATCH_CACHE_SIZE > 0 else None
+# Process pool sharing mmap'd index snapshots, started in __main__ when MATCH_WORKERS > 0
+match_pool = None
 
 BUFFER_SIZE = 150  # 5 seconds at 30fps
 animal_counters = defaultdict(lambda: {"dog": 0, "cat": 0})
@@ -144,6 +369,10 @@ def preprocess_image(image):
     img = img / 255.0
     return np.expand_dims(img, axis=0)
 
+def classify_stray(image):
+    """Stray-classifier output row for one crop, computed in a micro-batch with other cameras' crops"""
+    return stray_classifier.submit(preprocess_image(image)[0]).result()
+
 def remove_green_border(image):
     # Filters out green background used in bounding boxes
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
@@ -157,17 +386,37 @@ def remove_green_border(image):
     return image
 
 def get_image_embedding(img):
-    # Convert BGR (OpenCV) to RGB
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    resized = cv2.resize(img_rgb, (224, 224))
-    x = np.expand_dims(resized, axis=0).astype('float32')
-    x = preprocess_input(x)
-    return feature_extractor.predict(x)[0]
+    # BGR (OpenCV) crop -> pooled features of the configured EMBEDDING_BACKEND
+    return models.get('embedder').embed(img)
+
+def get_image_embeddings(imgs):
+    """Embed several BGR images with one embedding backend call"""
+    return models.get('embedder').embed_batch(imgs)
+
+def detect_species(img):
+    """Species of the most confident dog/cat detection in a registry image, or None"""
+    best_label, best_conf = None, 0
+    # Through the detection batcher like the camera frames: the detector model is not safe to call from two threads
+    for class_id, confidence, _ in result_boxes(detect(img)):
+        label = 'dog' if class_id == DOG_CLASS_ID else 'cat' if class_id == CAT_CLASS_ID else None
+        if label and confidence > best_conf:
+            best_label, best_conf = label, confidence
+    return best_label
 
 def precompute_owner_embeddings():
     """
-    Load pet images from DATABASE_PATH and precompute their embeddings for faster matching
+    Load pet images from DATABASE_PATH and precompute their features for faster matching.
+
+    Builds a fresh OwnerIndex (colour histogram, ORB keypoints/descriptors and
+    CNN embedding per image) and swaps it in once it is complete, so matches
+    running in other threads never see a half-built index.
+    
+    With OWNER_INDEX_FILE only one worker process builds the index and writes it
+    to the shared file; the other workers map that file instead. The builder
+    starts from the file a previous run (or --build-owner-index) left behind
+    and only re-describes the images that changed since.
     """
+    global species_labels, owner_index_ready, owner_index_error
     print(f"Loading pet images from: {DATABASE_PATH}")
     count = 0
     
@@ -177,34 +426,210 @@ def precompute_owner_embeddings():
             print(f"WARNING: Directory {DATABASE_PATH} does not exist!")
             os.makedirs(DATABASE_PATH, exist_ok=True)
             print(f"Created directory {DATABASE_PATH}")
+            # Nothing registered yet, the empty index is complete
+            owner_index_ready, owner_index_error = True, None
             return 0
             
-        # List all files in the directory
-        image_files = [f for f in os.listdir(DATABASE_PATH) 
-                     if f.lower().endswith((".jpg", ".png", ".jpeg"))]
-        
-        print(f"Found {len(image_files)} image files in {DATABASE_PATH}")
-        
-        for fname in image_files:
-            path = os.path.join(DATABASE_PATH, fname)
-            img = cv2.imread(path)
-            
-            if img is None:
-                print(f"Failed to read image: {path}")
-                continue
-                
-            # Store the embedding
-            embedding = get_image_embedding(img)
-            owner_embeddings[fname] = embedding
-            count += 1
+        with owner_index_lock:
+            if is_owner_index_builder():
+                if species_labels is None:
+                    species_labels = SpeciesLabels(SPECIES_METADATA, detect_species)
+                new_index = load_previous_owner_index()
+                if new_index is None:
+                    new_index = build_owner_index(DATABASE_PATH, orb, get_image_embedding, embedding_cache,
+                                                  species_labels)
+                else:
+                    new_index, _ = update_owner_index(new_index, orb, get_image_embedding, embedding_cache,
+                                                      species_labels=species_labels)
+                new_index = publish_owner_index(new_index)
+            else:
+                new_index = wait_for_owner_index_file()
+            install_owner_index(new_index)
+            count = len(new_index)
             
-        print(f"Successfully loaded {count} pet images and computed embeddings")
+        print(f"Successfully loaded {count} pet images and computed embeddings ({new_index.species_counts()})")
     except Exception as e:
         print(f"Error loading pet database: {str(e)}")
+        # Not ready until a later refresh installs an index
+        owner_index_error = str(e)
     
     return count
 
-def match_snapshot_to_owner(snapshot_img, threshold=0.65):
+def refresh_owner_index():
+    """
+    Apply registry changes (new, modified or deleted pet images) to the owner index.
+
+    Only changed images are re-described. The updated index is built next to
+    the current one and swapped in with a single assignment, so in-flight
+    matches keep using the snapshot they started with.
+    
+    Workers that don't build OWNER_INDEX_FILE just map it again when the
+    builder has published a new version.
+    """
+    global species_labels
+    with owner_index_lock:
+        if not is_owner_index_builder():
+            return reload_owner_index_file()
+        if species_labels is None:
+            species_labels = SpeciesLabels(SPECIES_METADATA, detect_species)
+        new_index, changes = update_owner_index(owner_index, orb, get_image_embedding, embedding_cache,
+                                                species_labels=species_labels)
+        if new_index is owner_index:
+            return changes
+        new_index = publish_owner_index(new_index)
+        install_owner_index(new_index)
+
+    print(f"Owner index updated: {len(changes['added'])} added, {len(changes['updated'])} updated, "
+          f"{len(changes['removed'])} removed ({len(new_index)} total)")
+    return changes
+
+def install_owner_index(new_index):
+    """Attach search structures to new_index and swap it in; callers hold owner_index_lock"""
+    global owner_index, owner_embeddings, owner_index_ready, owner_index_error
+    prepare_owner_index(new_index)
+    owner_embeddings = new_index.embeddings
+    owner_index = new_index
+    owner_index_ready, owner_index_error = True, None
+    if match_cache is not None:
+        match_cache.clear()
+
+def is_owner_index_builder():
+    """
+    Whether this process builds the owner index.
+
+    Always true without OWNER_INDEX_FILE. Otherwise the first process to lock
+    the file builds and publishes it; the others retry on every refresh, so
+    one of them takes over if the builder exits.
+    """
+    global owner_index_builder
+    if not OWNER_INDEX_FILE:
+        return True
+    if owner_index_builder is None:
+        lock_file = open(OWNER_INDEX_FILE + '.lock', 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        owner_index_builder = lock_file
+        print(f"Process {os.getpid()} builds the shared owner index {OWNER_INDEX_FILE}")
+    return True
+
+def publish_owner_index(new_index):
+    """
+    With OWNER_INDEX_FILE, write new_index to the shared file and return the memory-mapped copy.
+
+    With ORB_MATCHER=lsh the LSH tables go into the file as well, so the workers share them too.
+    """
+    if not OWNER_INDEX_FILE:
+        return new_index
+    lsh = {'n_tables': LSH_TABLES, 'key_bits': LSH_KEY_BITS} if ORB_MATCHER == 'lsh' else None
+    save_owner_index(new_index, OWNER_INDEX_FILE, lsh=lsh)
+    return load_owner_index(OWNER_INDEX_FILE)
+
+def load_previous_owner_index():
+    """The existing OWNER_INDEX_FILE to update instead of rebuilding from scratch, or None"""
+    if not OWNER_INDEX_FILE or file_stamp(OWNER_INDEX_FILE) is None:
+        return None
+    try:
+        return load_owner_index(OWNER_INDEX_FILE)
+    except (OSError, ValueError) as e:
+        print(f"Rebuilding {OWNER_INDEX_FILE}: {e}")
+        return None
+
+def wait_for_owner_index_file():
+    """Map OWNER_INDEX_FILE, waiting for the builder process to write it the first time"""
+    while file_stamp(OWNER_INDEX_FILE) is None:
+        print(f"Waiting for {OWNER_INDEX_FILE} to be built by another worker...")
+        time.sleep(2)
+    return load_owner_index(OWNER_INDEX_FILE)
+
+def reload_owner_index_file():
+    """Map OWNER_INDEX_FILE again if the builder has replaced it; returns the changes like update_owner_index"""
+    changes = {'added': [], 'updated': [], 'removed': []}
+    stamp = file_stamp(OWNER_INDEX_FILE)
+    if stamp is None or stamp == getattr(owner_index, 'stamp', None):
+        return changes
+    
+    new_index = load_owner_index(OWNER_INDEX_FILE)
+    for fname, entry in new_index.items():
+        if fname not in owner_index:
+            changes['added'].append(fname)
+        elif owner_index.entries[fname].get('stat') != entry.get('stat'):
+            changes['updated'].append(fname)
+    changes['removed'] = [fname for fname in owner_index if fname not in new_index]
+    install_owner_index(new_index)
+    print(f"Reloaded shared owner index {OWNER_INDEX_FILE} ({len(new_index)} pets)")
+    return changes
+
+def load_owner_registry():
+    """
+    Build the owner index once the embedder has loaded, then keep it in sync with DATABASE_PATH.
+
+    owner_index_ready is set when an index is installed; if the first build fails, the registry watcher
+    keeps retrying it.
+    """
+    precompute_owner_embeddings()
+    watch_owner_registry()
+
+def watch_owner_registry():
+    """Poll DATABASE_PATH so pets registered through the web app become matchable without a restart"""
+    while True:
+        time.sleep(REGISTRY_POLL_INTERVAL)
+        try:
+            if os.path.exists(DATABASE_PATH):
+                refresh_owner_index()
+        except Exception as e:
+            print(f"Error refreshing owner index: {e}")
+
+def record_match_stages(stages):
+    """Accumulate per-stage candidate counts and timings for /api2/match/stats"""
+    with match_stats_lock:
+        match_stage_stats['matches'] += 1
+        for stage, info in stages.items():
+            totals = match_stage_stats['stages'].setdefault(stage, defaultdict(float))
+            totals['runs'] += 0 if info.get('skipped') else 1
+            for key, value in info.items():
+                if key != 'skipped':
+                    totals[key] += float(value)
+
+def prepare_owner_index(index, partition=True, version=None):
+    """
+    Attach the configured search structures to a freshly built index before it is swapped in.
+
+    The species partitions are prepared with the same match_pool snapshot version as the whole index.
+    """
+    version = version or uuid.uuid4().hex
+    if partition and MATCH_BY_SPECIES and any(entry.get('species') for entry in index.entries.values()):
+        for species in SPECIES:
+            index.partitions[species] = index.partition(species)
+            prepare_owner_index(index.partitions[species], partition=False, version=version)
+    index.embedding_search = build_embedding_search(index.embeddings)
+    if MATCH_PROTOTYPES:
+        pet_ids.reload_if_changed()
+        index.gallery = PetGallery(index, max_exemplars=PET_EXEMPLARS, pet_id_fn=pet_ids)
+        index.gallery.prototype_search = build_embedding_search(index.gallery.centroids)
+        # Embedding searches go through the pet centroids and then the closest pets' exemplars
+        index.embedding_search = index.gallery
+    # Indexes mapped from OWNER_INDEX_FILE come with the shared LSH tables
+    if ORB_MATCHER == 'lsh' and index.lsh is None:
+        index.lsh = HammingLSH(index.descriptors, n_tables=LSH_TABLES, key_bits=LSH_KEY_BITS)
+    # The pool only runs the packed matcher over plain (non-gallery) indexes, see match_snapshot_to_owner
+    if match_pool is not None and ORB_MATCHER == 'packed' and index.gallery is None:
+        index.pool_snapshot = match_pool.publish(index, version)
+
+def build_embedding_search(embeddings):
+    """Wrap the owner embeddings in an ANN index when configured and the registry is large enough"""
+    if EMBEDDING_SEARCH == 'ivf' and len(embeddings) >= ANN_MIN_SIZE:
+        start = time.time()
+        # With a shared index file the IVF lists keep row ids into the mapped matrix rather than a private copy
+        ann = IVFFlatIndex(embeddings, nlist=ANN_NLIST or None, nprobe=ANN_NPROBE, shared=bool(OWNER_INDEX_FILE))
+        print(f"Built IVF index with {ann.nlist} lists over {len(embeddings)} embeddings in {time.time() - start:.1f}s")
+        return ann
+    return embeddings
+
+def match_snapshot_to_owner(snapshot_img, threshold=0.65, index=None, embedding_results=None, animal_type=None,
+                            embed_fn=None, all_embeddings=False):
     """
     Match a detected animal to owner records using visual similarities.
     Uses both color histogram matching and feature detection for improved accuracy.
@@ -212,11 +637,49 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
     
     Lowered threshold to 0.65 to be more permissive with matches.
     
+    Owner features come from the precomputed owner_index, so only the
+    snapshot's histogram, ORB descriptors and embedding are computed here.
+    
+    Matching is staged so the expensive steps only see likely candidates:
+      1. color: H/S histogram correlation against every pet in one matrix product,
+         keeping the MATCH_COLOR_TOP_K most similar coats
+      2. orb: ORB matching on those survivors (best color first), stopping early
+         once a match scores MATCH_EARLY_EXIT_SCORE. With ORB_MATCHER=packed the
+         cross-checked Hamming matches of all survivors are computed in one pass
+      3. embedding: CNN embedding search, only when no visual match was found. This is a
+         fallback over the whole registry, not a rerank of the ORB shortlist: the shortlist
+         is chosen by coat colour, so a pet photographed under different light may not be
+         on it, and a rerank would run the backbone for every crop that did not exit
+         early, while the fallback skips it for every visual match
+    With MATCH_PROTOTYPES the color and embedding stages compare one prototype per pet
+    first and only expand the closest pets to their PET_EXEMPLARS exemplar photos.
+    With MATCH_WORKERS > 0 (packed matcher, no prototypes) stages 1-2 run sharded on
+    the match_pool worker processes and are reported as a single 'pool' stage.
+    Candidate counts and timings per stage are returned under 'stages'.
+    
+    Args:
+        index: OwnerIndex to match against, defaults to the current owner_index
+        embedding_results: precomputed [(filename, similarity), ...] for stage 3, as
+            produced by a batched search
+        embed_fn: embeds the snapshot for stage 3, get_image_embedding by default
+            (/api2/match/batch passes one that goes through embedding_batcher)
+        animal_type: 'dog' or 'cat' to search only that species' partition of the index
+            (pets without a species label are in both)
+        all_embeddings: stage 3 scores every registered embedding exactly and reports each one above
+            the threshold in 'all_matches' (/api2/all-matches), instead of the EMBEDDING_TOP_K nearest
+    
     Returns the match with the highest confidence level.
     """
     best_match = None
     best_score = -1
     match_method = "unknown"
+    stages = {}
+    
+    # Take a reference to the current index so a concurrent rebuild can't change it mid-match
+    if index is None:
+        index = owner_index
+    if animal_type in index.partitions:
+        index = index.partitions[animal_type]
     
     # Track all potential matches for similar colored animals
     all_matches = []
@@ -225,53 +688,85 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
     visual_matches = []
     embedding_matches = []
     
-    # First try visual feature matching for better animal recognition
-    for fname in owner_embeddings:
-        path = os.path.join(DATABASE_PATH, fname)
-        owner_img = cv2.imread(path)
-        if owner_img is None:
-            continue
+    good_matches_threshold = 50  # Maximum distance for a "good" match
+    bulk_good_counts = None
+    
+    if match_pool is not None and index.pool_snapshot is not None and ORB_MATCHER == 'packed' and index.gallery is None:
+        # Stages 1-2 on the worker processes: each scores the colors of one registry shard and
+        # cross-checks ORB descriptors for its own top-K, the merge keeps the global top-K
+        stage_start = time.perf_counter()
+        hist1 = compute_color_histogram(snapshot_img)
+        keypoints1, descriptors1 = compute_orb_features(snapshot_img, orb)
+        candidates, candidate_colors, bulk_good_counts, bulk_avg_distances = match_pool.score(
+            index.pool_snapshot, len(index), hist1, descriptors1, MATCH_COLOR_TOP_K, good_matches_threshold)
+        stages['pool'] = {
+            'candidates': len(index),
+            'survivors': len(candidates),
+            'workers': match_pool.workers,
+            'ms': (time.perf_counter() - stage_start) * 1000
+        }
+        stage_start = time.perf_counter()
+    else:
+        # Stage 1: color histogram correlation against the whole registry at once
+        stage_start = time.perf_counter()
+        hist1 = compute_color_histogram(snapshot_img)
+        if index.gallery is not None:
+            # One color prototype per pet; the closest pets are expanded to their exemplar photos
+            candidates, candidate_colors = index.gallery.color_candidates(
+                correlation_rows([hist1])[0], MATCH_COLOR_TOP_K)
+        else:
+            color_sims = index.color_similarities(hist1)
+            candidates = np.arange(len(color_sims))
+            if 0 < MATCH_COLOR_TOP_K < len(color_sims):
+                candidates = np.argpartition(-color_sims, MATCH_COLOR_TOP_K - 1)[:MATCH_COLOR_TOP_K]
+            candidates = candidates[np.argsort(-color_sims[candidates], kind='stable')]
+            candidate_colors = color_sims[candidates]
+        stages['color'] = {
+            'candidates': len(index.gallery) if index.gallery is not None else len(index),
+            'survivors': len(candidates),
+            'ms': (time.perf_counter() - stage_start) * 1000
+        }
+        
+        # Stage 2: ORB feature matching on the color survivors
+        stage_start = time.perf_counter()
+        keypoints1, descriptors1 = compute_orb_features(snapshot_img, orb)
+        
+        # With the LSH matcher only the top-voted survivors get full ORB verification,
+        # the others keep their color score with no feature matches
+        verify_positions = np.arange(len(candidates))
+        if ORB_MATCHER == 'lsh' and index.lsh is not None and descriptors1 is not None and len(descriptors1) > 10:
+            lsh_start = time.perf_counter()
+            voted = index.lsh.candidates(descriptors1, LSH_CANDIDATES, among=candidates)
+            verify_positions = np.flatnonzero(np.isin(candidates, voted))
+            stages['lsh'] = {
+                'candidates': len(candidates),
+                'survivors': len(verify_positions),
+                'ms': (time.perf_counter() - lsh_start) * 1000
+            }
+        
+        # With the packed (or LSH) matcher every verified survivor is scored against the query in one bulk pass
+        if ORB_MATCHER in ('packed', 'lsh') and descriptors1 is not None and len(descriptors1) > 10:
+            owner_descriptors, seg_offsets = index.descriptors.gather(candidates[verify_positions])
+            pet_of_match, distances = cross_check_match(descriptors1, owner_descriptors, seg_offsets)
+            good_counts, avg_distances = summarize_matches(
+                pet_of_match, distances, len(verify_positions), top_n=30, good_threshold=good_matches_threshold)
+            bulk_good_counts = np.zeros(len(candidates), dtype=np.int64)
+            bulk_avg_distances = np.zeros(len(candidates))
+            bulk_good_counts[verify_positions] = good_counts
+            bulk_avg_distances[verify_positions] = avg_distances
+    
+    compared = 0
+    early_exit = False
+    for position, candidate in enumerate(candidates):
+        fname = index.names[candidate]
+        owner_features = index.entries[fname]
+        path = index.path(fname)
+        color_sim = float(candidate_colors[position])
+        compared += 1
             
         try:
-            # Color histogram comparison - effective for dog coat colors
-            # Convert to HSV color space which better represents color similarities
-            hsv1 = cv2.cvtColor(snapshot_img, cv2.COLOR_BGR2HSV)
-            hsv2 = cv2.cvtColor(owner_img, cv2.COLOR_BGR2HSV)
-            
-            # Calculate histograms for hue and saturation channels
-            h_bins = 50
-            s_bins = 60
-            histSize = [h_bins, s_bins]
-            # hue varies from 0 to 179, saturation from 0 to 255
-            ranges = [0, 180, 0, 256] 
-            
-            hist1 = cv2.calcHist([hsv1], [0, 1], None, histSize, ranges)
-            hist2 = cv2.calcHist([hsv2], [0, 1], None, histSize, ranges)
-            
-            cv2.normalize(hist1, hist1, 0, 1, cv2.NORM_MINMAX)
-            cv2.normalize(hist2, hist2, 0, 1, cv2.NORM_MINMAX)
-            
-            # Compare histograms - correlation method works well for color similarity
-            color_sim = cv2.compareHist(hist1, hist2, cv2.HISTCMP_CORREL)
-            
-            # Feature matching with ORB
-            # Convert to grayscale for feature detection
-            gray1 = cv2.cvtColor(snapshot_img, cv2.COLOR_BGR2GRAY)
-            gray2 = cv2.cvtColor(owner_img, cv2.COLOR_BGR2GRAY)
-            
-            # Resize images to be similar scale for better comparison
-            max_dim = 512
-            scale1 = max_dim / max(gray1.shape)
-            scale2 = max_dim / max(gray2.shape)
-            
-            if scale1 < 1:
-                gray1 = cv2.resize(gray1, (int(gray1.shape[1] * scale1), int(gray1.shape[0] * scale1)))
-            if scale2 < 1:
-                gray2 = cv2.resize(gray2, (int(gray2.shape[1] * scale2), int(gray2.shape[0] * scale2)))
-            
-            # Detect keypoints and compute descriptors
-            keypoints1, descriptors1 = orb.detectAndCompute(gray1, None)
-            keypoints2, descriptors2 = orb.detectAndCompute(gray2, None)
+            keypoints2 = owner_features['keypoints']
+            descriptors2 = owner_features['descriptors']
             
             # Check if we have enough keypoints
             feature_sim = 0
@@ -279,32 +774,32 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
             match_points = 0
             
             if descriptors1 is not None and descriptors2 is not None and len(descriptors1) > 10 and len(descriptors2) > 10:
-                # Match keypoints
-                matches = bf.match(descriptors1, descriptors2)
-                
-                # Sort matches by distance (lower is better)
-                matches = sorted(matches, key=lambda x: x.distance)
-                
-                # Take only good matches (lower distance)
-                # For feature confidence, use inverse of normalized distance
-                good_matches_threshold = 50  # Maximum distance for a "good" match
-                good_matches = [m for m in matches[:30] if m.distance < good_matches_threshold]
+                if bulk_good_counts is not None:
+                    good_count = int(bulk_good_counts[position])
+                    avg_distance = float(bulk_avg_distances[position])
+                else:
+                    # Match keypoints
+                    matches = bf.match(descriptors1, descriptors2)
+                    
+                    # Sort matches by distance (lower is better)
+                    matches = sorted(matches, key=lambda x: x.distance)
+                    
+                    # Take only good matches (lower distance)
+                    # For feature confidence, use inverse of normalized distance
+                    good_matches = [m for m in matches[:30] if m.distance < good_matches_threshold]
+                    good_count = len(good_matches)
+                    avg_distance = sum(m.distance for m in good_matches) / good_count if good_count else 0
                 
                 # Calculate better feature confidence based on match quality
-                if len(good_matches) > 0:
-                    # Calculate average distance of good matches (lower is better)
-                    avg_distance = sum(m.distance for m in good_matches) / len(good_matches)
-                    # Convert to confidence (inverse of normalized distance)
+                if good_count > 0:
+                    # Convert average distance of good matches to confidence (inverse of normalized distance)
                     # Distance ranges from 0 to good_matches_threshold
                     # So confidence will range from 1.0 (perfect match, distance=0) to 0.0 (worst match, distance=threshold)
                     feature_confidence = 1.0 - (avg_distance / good_matches_threshold)
                     
-                    # Additional factor: ratio of good matches to total keypoints
-                    match_ratio = len(good_matches) / min(len(keypoints1), len(keypoints2))
-                    
                     # Calculate feature similarity score based on quality of matches
-                    feature_sim = len(good_matches) / min(len(keypoints1), len(keypoints2))
-                    match_points = len(good_matches)
+                    feature_sim = good_count / min(len(keypoints1), len(keypoints2))
+                    match_points = good_count
             
             # Combined similarity score with weighted factors based on match quality
             # We give more weight to feature matching if the confidence is high
@@ -344,20 +839,39 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
                 
         except Exception as e:
             print(f"Error comparing images: {e}")
+        
+        # Candidates are visited best color first, so a confident match ends the stage
+        if best_match is not None and best_score >= MATCH_EARLY_EXIT_SCORE:
+            early_exit = True
+            break
+    
+    stages['orb'] = {
+        'candidates': len(candidates),
+        'compared': compared,
+        'early_exit': early_exit,
+        'ms': (time.perf_counter() - stage_start) * 1000
+    }
     
-    # If no good visual match, fall back to the existing CNN embedding method
+    # Stage 3: if no good visual match, fall back to the existing CNN embedding method (over the whole
+    # registry rather than reranking the colour-based shortlist, see the docstring)
+    stage_start = time.perf_counter()
     if best_match is None:
-        query_embedding = get_image_embedding(snapshot_img)
-        for fname, db_embedding in owner_embeddings.items():
-            sim = cosine_similarity([query_embedding], [db_embedding])[0][0]
-            
+        if all_embeddings:
+            query_embedding = (embed_fn or get_image_embedding)(snapshot_img)
+            embedding_results = index.embeddings.search(query_embedding, k=len(index.embeddings))
+        elif embedding_results is None:
+            query_embedding = (embed_fn or get_image_embedding)(snapshot_img)
+            # Top-K nearest owner embeddings (exact matrix product or IVF index, see EMBEDDING_SEARCH)
+            embedding_results = index.embedding_search.search(query_embedding, k=EMBEDDING_TOP_K)
+        for fname, sim in embedding_results:
             # Add to embedding matches list
             embedding_matches.append((fname, sim, "embedding"))
             
-            if sim > best_score and sim >= threshold * 0.9:  # Slightly lower threshold for CNN
-                best_score = sim
-                best_match = fname
-                match_method = "embedding"
+            if sim >= threshold * 0.9:  # Slightly lower threshold for CNN
+                if sim > best_score:
+                    best_score = sim
+                    best_match = fname
+                    match_method = "embedding"
                 
                 # Also add to all_matches for completeness
                 all_matches.append({
@@ -368,8 +882,17 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
                     'feature_confidence': 0,  # Not applicable for CNN embedding
                     'match_points': 0,  # Not applicable for CNN embedding
                     'method': 'embedding',
-                    'path': os.path.join(DATABASE_PATH, fname)
+                    'path': index.path(fname)
                 })
+        
+        stages['embedding'] = {
+            'candidates': len(index.embeddings),
+            'survivors': len(embedding_matches),
+            'ms': (time.perf_counter() - stage_start) * 1000
+        }
+    else:
+        stages['embedding'] = {'skipped': True}
+    record_match_stages(stages)
     
     # After trying all methods, find the match with highest confidence
     # Combine all matches from different methods and sort by score
@@ -400,8 +923,9 @@ def match_snapshot_to_owner(snapshot_img, threshold=0.65):
         'score': float(best_score) if best_score > -1 else 0.0,
         'method': match_method,
         'all_matches': all_matches,  # Include all potential matches
-        'highest_confidence_matches': all_method_matches[:5] if all_method_matches else []  # Include top 5 high confidence matches
-    } if best_match else {'all_matches': all_matches, 'highest_confidence_matches': all_method_matches[:5] if all_method_matches else []} if all_matches else None
+        'highest_confidence_matches': all_method_matches[:5] if all_method_matches else [],  # Include top 5 high confidence matches
+        'stages': stages
+    } if best_match else {'all_matches': all_matches, 'highest_confidence_matches': all_method_matches[:5] if all_method_matches else [], 'stages': stages} if all_matches else None
 
 def stream_static_video(stream_id, video_path):
     cap = cv2.VideoCapture(video_path)
@@ -610,15 +1134,24 @@ def stream_static_video(stream_id, video_path):
         
         return combined_similarity
 
+    frame_index = 0
     while True:
         ret, frame = cap.read()
         if not ret:
             cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            frame_index = 0
+            # A loop is complete, persist what it detected
+            if stream_id in detection_caches:
+                detection_caches[stream_id].save()
             continue
 
         resized = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT))
         debug_snapshot = resized.copy()
-        results = model.predict(resized, imgsz=(FRAME_WIDTH, FRAME_HEIGHT), device='cuda')
+        # Until the detector has loaded, or on static scenes, frames go straight to HLS and the trackers just age;
+        # between keyframes the trackers follow propagated boxes, and frames seen on an earlier loop replay
+        # their cached boxes
+        boxes = frame_boxes(stream_id, resized, video_detection_cache(stream_id, video_path), frame_index)
+        frame_index += 1
         current_time = time.time()
 
         # Track all currently detected boxes
@@ -627,46 +1160,43 @@ def stream_static_video(stream_id, video_path):
             'cat': set()
         }
 
-        for result in results:
-            for box in result.boxes:
-                class_id = int(box.cls.item())
-                confidence = box.conf.item()
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
+        for class_id, confidence, (x1, y1, x2, y2) in boxes:
 
-                if confidence > 0.6:
-                    label = 'dog' if class_id == DOG_CLASS_ID else 'cat' if class_id == CAT_CLASS_ID else None
-                    if not label:
-                        continue
+            if confidence > 0.6:
+                label = 'dog' if class_id == DOG_CLASS_ID else 'cat' if class_id == CAT_CLASS_ID else None
+                if not label:
+                    continue
 
-                    cv2.rectangle(resized, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                cv2.rectangle(resized, (x1, y1), (x2, y2), (0, 255, 0), 2)
 
-                    box_center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                    box_area = (x2 - x1) * (y2 - y1)
-                    crop = resized[y1:y2, x1:x2].copy()  # Create a copy to avoid reference issues
-                    
-                    # Try to match with existing tracker
-                    tracker, update_crop = find_matching_tracker(label, box_center, box_area, crop, current_time)
-                    
-                    # If no matching tracker, create a new one
-                    if tracker is None:
-                        tracker = create_new_tracker(label, box_center, box_area, crop, current_time)
-                        update_crop = True  # Always update crop for new trackers
-                    
-                    # Mark this tracker as detected in this frame
-                    detected_in_frame[label].add(tracker['id'])
-                    
-                    # Update best crop if needed
-                    if update_crop:
-                        tracker['max_area'] = box_area
-                        tracker['best_crop'] = crop
-                    
-                    # Save snapshot if needed
-                    snap_key = f"{label}{tracker['id']}"
-                    if not tracker['snapshot_saved'] and snap_key not in stream_data[stream_id]['snapshots']:
-                        snapshot_path = os.path.join(save_path, f"{stream_id}_snapshot_{snap_key}.jpg")
-                        cv2.imwrite(snapshot_path, debug_snapshot)
-                        stream_data[stream_id]['snapshots'][snap_key] = snapshot_path
-                        tracker['snapshot_saved'] = True
+                box_center = ((x1 + x2) // 2, (y1 + y2) // 2)
+                box_area = (x2 - x1) * (y2 - y1)
+                crop = resized[y1:y2, x1:x2].copy()  # Create a copy to avoid reference issues
+                
+                # Try to match with existing tracker
+                tracker, update_crop = find_matching_tracker(label, box_center, box_area, crop, current_time)
+                
+                # If no matching tracker, create a new one
+                if tracker is None:
+                    tracker = create_new_tracker(label, box_center, box_area, crop, current_time)
+                    update_crop = True  # Always update crop for new trackers
+                
+                # Mark this tracker as detected in this frame
+                detected_in_frame[label].add(tracker['id'])
+                
+                # Update best crop if needed
+                if update_crop:
+                    tracker['max_area'] = box_area
+                    tracker['best_crop'] = crop
+                    tracker['best_confidence'] = confidence
+                
+                # Save snapshot if needed
+                snap_key = f"{label}{tracker['id']}"
+                if not tracker['snapshot_saved'] and snap_key not in stream_data[stream_id]['snapshots']:
+                    snapshot_path = os.path.join(save_path, f"{stream_id}_snapshot_{snap_key}.jpg")
+                    cv2.imwrite(snapshot_path, debug_snapshot)
+                    stream_data[stream_id]['snapshots'][snap_key] = snapshot_path
+                    tracker['snapshot_saved'] = True
 
         # Check for trackers that were not detected in this frame
         for label in ['dog', 'cat']:
@@ -706,13 +1236,12 @@ def stream_static_video(stream_id, video_path):
                                     
                                     # Only run classification and matching if this is a new or updated snapshot
                                     if should_process:
-                                        # Start async processing in a separate thread
-                                        threading.Thread(
-                                            target=process_animal_async,
-                                            args=(tracker['best_crop'], stream_id, label, tracker['id']),
-                                            daemon=True
-                                        ).start()
-                                        print(f"[{stream_id}] Started async processing for {label}{track_id}")
+                                        # Queue for the analysis workers, most confident and largest crops first
+                                        priority = analysis_priority(tracker.get('best_confidence', 0.0), tracker['best_crop'])
+                                        if analysis_pool.submit(priority, tracker['best_crop'], stream_id, label, tracker['id']):
+                                            print(f"[{stream_id}] Queued async processing for {label}{track_id}")
+                                        else:
+                                            print(f"[{stream_id}] Analysis queue full, skipped {label}{track_id}")
                                     
                                 # Count animal only once when it's processed
                                 animal_counters[stream_id][label] += 1
@@ -962,7 +1491,9 @@ def process_stream(stream_id):
 
         frame = stream_data[stream_id]['buffer'].popleft()
         debug_snapshot = frame.copy()
-        results = model.predict(frame, imgsz=(FRAME_WIDTH, FRAME_HEIGHT), device='cuda')
+        # Until the detector has loaded, or on static scenes, frames go straight to HLS and the trackers just age;
+        # between keyframes the trackers follow propagated boxes
+        boxes = frame_boxes(stream_id, frame)
         current_time = time.time()
 
         # Track all currently detected boxes
@@ -971,46 +1502,43 @@ def process_stream(stream_id):
             'cat': set()
         }
 
-        for result in results:
-            for box in result.boxes:
-                class_id = int(box.cls.item())
-                confidence = box.conf.item()
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
+        for class_id, confidence, (x1, y1, x2, y2) in boxes:
 
-                if confidence > 0.6:
-                    label = 'dog' if class_id == DOG_CLASS_ID else 'cat' if class_id == CAT_CLASS_ID else None
-                    if not label:
-                        continue
+            if confidence > 0.6:
+                label = 'dog' if class_id == DOG_CLASS_ID else 'cat' if class_id == CAT_CLASS_ID else None
+                if not label:
+                    continue
 
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
 
-                    box_center = ((x1 + x2) // 2, (y1 + y2) // 2)
-                    box_area = (x2 - x1) * (y2 - y1)
-                    crop = frame[y1:y2, x1:x2].copy()
-                    
-                    # Try to match with existing tracker
-                    tracker, update_crop = find_matching_tracker(label, box_center, box_area, crop, current_time)
-                    
-                    # If no matching tracker, create a new one
-                    if tracker is None:
-                        tracker = create_new_tracker(label, box_center, box_area, crop, current_time)
-                        update_crop = True  # Always update crop for new trackers
-                    
-                    # Mark this tracker as detected in this frame
-                    detected_in_frame[label].add(tracker['id'])
-                    
-                    # Update best crop if needed
-                    if update_crop:
-                        tracker['max_area'] = box_area
-                        tracker['best_crop'] = crop
-                    
-                    # Save snapshot if needed
-                    snap_key = f"{label}{tracker['id']}"
-                    if not tracker['snapshot_saved'] and snap_key not in stream_data[stream_id]['snapshots']:
-                        snapshot_path = os.path.join(save_path, f"{stream_id}_snapshot_{snap_key}.jpg")
-                        cv2.imwrite(snapshot_path, debug_snapshot)
-                        stream_data[stream_id]['snapshots'][snap_key] = snapshot_path
-                        tracker['snapshot_saved'] = True
+                box_center = ((x1 + x2) // 2, (y1 + y2) // 2)
+                box_area = (x2 - x1) * (y2 - y1)
+                crop = frame[y1:y2, x1:x2].copy()
+                
+                # Try to match with existing tracker
+                tracker, update_crop = find_matching_tracker(label, box_center, box_area, crop, current_time)
+                
+                # If no matching tracker, create a new one
+                if tracker is None:
+                    tracker = create_new_tracker(label, box_center, box_area, crop, current_time)
+                    update_crop = True  # Always update crop for new trackers
+                
+                # Mark this tracker as detected in this frame
+                detected_in_frame[label].add(tracker['id'])
+                
+                # Update best crop if needed
+                if update_crop:
+                    tracker['max_area'] = box_area
+                    tracker['best_crop'] = crop
+                    tracker['best_confidence'] = confidence
+                
+                # Save snapshot if needed
+                snap_key = f"{label}{tracker['id']}"
+                if not tracker['snapshot_saved'] and snap_key not in stream_data[stream_id]['snapshots']:
+                    snapshot_path = os.path.join(save_path, f"{stream_id}_snapshot_{snap_key}.jpg")
+                    cv2.imwrite(snapshot_path, debug_snapshot)
+                    stream_data[stream_id]['snapshots'][snap_key] = snapshot_path
+                    tracker['snapshot_saved'] = True
 
         # Check for trackers that were not detected in this frame
         for label in ['dog', 'cat']:
@@ -1050,13 +1578,12 @@ def process_stream(stream_id):
                                     
                                     # Only run classification and matching if this is a new or updated snapshot
                                     if should_process:
-                                        # Start async processing in a separate thread
-                                        threading.Thread(
-                                            target=process_animal_async,
-                                            args=(tracker['best_crop'], stream_id, label, tracker['id']),
-                                            daemon=True
-                                        ).start()
-                                        print(f"[{stream_id}] Started async processing for {label}{track_id}")
+                                        # Queue for the analysis workers, most confident and largest crops first
+                                        priority = analysis_priority(tracker.get('best_confidence', 0.0), tracker['best_crop'])
+                                        if analysis_pool.submit(priority, tracker['best_crop'], stream_id, label, tracker['id']):
+                                            print(f"[{stream_id}] Queued async processing for {label}{track_id}")
+                                        else:
+                                            print(f"[{stream_id}] Analysis queue full, skipped {label}{track_id}")
                                     
                                 # Count animal only once when it's processed
                                 animal_counters[stream_id][label] += 1
@@ -1255,13 +1782,28 @@ def classify_and_match(animal_img, stream_id, animal_type, animal_id=None):
     cleaned_path = os.path.join(debug_dir, f"{animal_type}{animal_id}_cropped_cleaned.jpg")
     cv2.imwrite(cleaned_path, cleaned)
     
-    # Get stray classification result
-    prediction = cnn_model.predict(preprocess_image(cleaned))[0]
+    # Near-duplicate crops of an animal seen recently reuse its classification and match; the species is part
+    # of the key since it selects the owner index partition the match was made against
+    cached = None
+    if match_cache is not None:
+        crop_hash = match_cache.key(cleaned, animal_type)
+        cache_generation = match_cache.generation
+        cached = match_cache.get(crop_hash)
+    
+    if cached is not None:
+        prediction, match_result = cached
+        print(f"Reusing cached classification/match for {animal_type}{animal_id} on {stream_id}")
+    else:
+        # Get stray classification result
+        prediction = classify_stray(cleaned)
+        
+        # Try to find a match with registered owners using enhanced matching
+        match_result = match_snapshot_to_owner(cleaned, animal_type=animal_type)
+        if match_cache is not None:
+            match_cache.put(crop_hash, (prediction, match_result), cache_generation)
+    
     is_stray = prediction >= 0.3
     classification_result = "stray" if is_stray else "not_stray"
-    
-    # Try to find a match with registered owners using enhanced matching
-    match_result = match_snapshot_to_owner(cleaned)
     match = match_result.get('match') if match_result else None
     match_score = match_result.get('score', 0) if match_result else 0
     match_method = match_result.get('method', 'none') if match_result else 'none'
@@ -1414,7 +1956,7 @@ def classify_and_match(animal_img, stream_id, animal_type, animal_id=None):
         "analysis_time": time.strftime("%Y-%m-%d %H:%M:%S")
     }
 
-# Function to process animal in a separate thread
+# Function to process animal on an analysis worker thread (see analysis_pool)
 def process_animal_async(animal_img, stream_id, animal_type, animal_id=None):
     """Run the classification and matching in a separate thread to avoid blocking the main stream processing"""
     result = classify_and_match(animal_img, stream_id, animal_type, animal_id)
@@ -1447,6 +1989,14 @@ def process_animal_async(animal_img, stream_id, animal_type, animal_id=None):
     print(f"[{stream_id}] Async processing complete for {animal_type}{animal_id}: {result.get('notification_case')}")
     return result
 
+def analysis_priority(confidence, crop):
+    """Queue priority of a finished track: detection confidence weighted by crop size (sqrt of its area)"""
+    return confidence * np.sqrt(crop.shape[0] * crop.shape[1])
+
+# Finished tracks of all cameras are classified and matched by a fixed number of workers
+analysis_pool = AnalysisPool(process_animal_async, ANALYSIS_WORKERS, ANALYSIS_QUEUE_SIZE,
+                             ANALYSIS_SHED_POLICY, ANALYSIS_BLOCK_TIMEOUT, name="analysis")
+
 def save_debug_images(stream_id):
     debug_dir = os.path.join("venv", "debug", stream_id)
     abs_debug_dir = os.path.abspath(debug_dir)
@@ -1491,12 +2041,12 @@ def save_debug_images(stream_id):
     cv2.imwrite(cleaned_path, cleaned)
 
     # Get classification result
-    prediction = cnn_model.predict(preprocess_image(cleaned))[0]
+    prediction = classify_stray(cleaned)
     is_stray = prediction >= 0.3
     classification_result = "stray" if is_stray else "not_stray"
 
     # Try to find a match with registered owners using enhanced matching
-    match_result = match_snapshot_to_owner(cleaned)
+    match_result = match_snapshot_to_owner(cleaned, animal_type=animal_type)
     match = match_result.get('match') if match_result else None
     match_score = match_result.get('score', 0) if match_result else 0
     match_method = match_result.get('method', 'none') if match_result else 'none'
@@ -1892,10 +2442,12 @@ def predict():
     animal_type = data.get("animal_type")
     if not os.path.exists(image_path):
         return jsonify({"error": "Image not found"}), 400
+    if not models.is_ready('classifier'):
+        return jsonify({"error": "Models are still loading", "models": models.status()}), 503
     image = cv2.imread(image_path)
     cropped = remove_green_border(image)
 
-    prediction = cnn_model.predict(preprocess_image(cropped))
+    prediction = classify_stray(cropped)
     is_stray = prediction[0] >= 0.3
 
     if not is_stray:
@@ -1941,8 +2493,8 @@ def show_all_matches(stream_id):
     # Clean the image
     cleaned = remove_green_border(high_conf_frame)
     
-    # Find all potential matches
-    match_result = match_snapshot_to_owner(cleaned)
+    # Find all potential matches, with every registered pet whose embedding is close enough rather than the top-K
+    match_result = match_snapshot_to_owner(cleaned, animal_type=animal_type, all_embeddings=True)
     if not match_result or 'all_matches' not in match_result or not match_result['all_matches']:
         return jsonify({"error": "No matches found", "animal_type": animal_type, "animal_id": animal_id}), 404
     
@@ -2126,16 +2678,162 @@ def get_notification_details(notification_id):
 @app.route('/api2/database/status')
 def check_database():
     """Debug endpoint to check database status"""
-    # Re-load database to ensure fresh data
-    count = precompute_owner_embeddings()
+    # Pick up any registry changes to ensure fresh data (only changed images are re-processed)
+    changes = refresh_owner_index() if os.path.exists(DATABASE_PATH) else {}
+    count = len(owner_index)
     
     return jsonify({
         "database_path": DATABASE_PATH,
         "files_loaded": count,
+        "species": owner_index.species_counts(),
+        "changes": {key: len(value) for key, value in changes.items()},
         "sample_files": list(owner_embeddings.keys())[:5] if owner_embeddings else [],
         "status": "ok" if count > 0 else "error"
     })
 
+@app.route('/api2/health/ready')
+def health_ready():
+    """
+    Per-model load state; 200 once every model and the owner index are ready, 503 until then.
+
+    With MODEL_LOADING=lazy the first probe starts loading the models nobody has asked for yet,
+    so an idle server still becomes ready.
+    """
+    ready = models.all_ready() and owner_index_ready
+    return jsonify({
+        "ready": ready,
+        "loading_mode": MODEL_LOADING,
+        "models": models.status(),
+        "owner_index": {"ready": owner_index_ready, "pets": len(owner_index), "error": owner_index_error}
+    }), 200 if ready else 503
+
+@app.route('/api2/detection/stats')
+def get_detection_stats():
+    """
+    Detector backend, cross-camera batching (batch sizes, time per batch and detector utilization),
+    the per-stream motion gate (frames seen and skipped), keyframes (frames detected vs propagated)
+    and the demo videos' detection caches (frames cached, replayed and missed)
+    """
+    return jsonify({
+        "max_batch": DETECT_BATCH_SIZE,
+        "max_wait_ms": DETECT_MAX_WAIT_MS,
+        "backend": models.get('detector').describe() if models.is_ready('detector') else None,
+        "batcher": detection_batcher.stats(),
+        "motion_gate": MOTION_GATE,
+        "streams": {stream_id: gate.stats() for stream_id, gate in list(motion_gates.items())},
+        "box_propagation": BOX_PROPAGATION,
+        "keyframes": {stream_id: keyframes.stats() for stream_id, keyframes in list(keyframe_trackers.items())},
+        "cache": {stream_id: cache.stats() for stream_id, cache in list(detection_caches.items())}
+    })
+
+@app.route('/api2/match/stats')
+def get_match_stats():
+    """Average candidates and time per matcher stage, for tuning MATCH_COLOR_TOP_K"""
+    with match_stats_lock:
+        matches = match_stage_stats['matches']
+        stages = {}
+        for stage, totals in match_stage_stats['stages'].items():
+            runs = totals.get('runs', 0)
+            stages[stage] = {'runs': int(runs)}
+            for key, value in totals.items():
+                if key != 'runs':
+                    stages[stage][f"avg_{key}"] = value / runs if runs else 0
+    
+    return jsonify({
+        "matches": matches,
+        "color_top_k": MATCH_COLOR_TOP_K,
+        "early_exit_score": MATCH_EARLY_EXIT_SCORE,
+        "stages": stages,
+        "result_cache": match_cache.stats() if match_cache is not None else None,
+        "stray_classifier": stray_classifier.stats(),
+        "analysis": analysis_pool.stats()
+    })
+
+@app.route('/api2/match/batch', methods=['POST'])
+def match_batch():
+    """
+    Classify and match many crops in one request.
+
+    Accepts a JSON body {"image_paths": [...]} or multipart uploads in the "images"
+    field (form "image_paths" fields are read too). An optional "animal_type"
+    ('dog' or 'cat') restricts matching to that species. Crops are processed in groups of
+    MATCH_BATCH_SIZE, matched in parallel: their classifications go through the
+    stray-classifier batcher, and only the crops without a visual match are embedded,
+    together through embedding_batcher. Results are streamed back as NDJSON, one line
+    per crop in request order.
+    """
+    data = request.get_json(silent=True) or {}
+    image_paths = data.get('image_paths')
+    if image_paths is not None and not (isinstance(image_paths, list) and all(isinstance(p, str) for p in image_paths)):
+        return jsonify({"error": "image_paths must be a list of strings"}), 400
+    sources = [(path, None) for path in image_paths or request.form.getlist('image_paths')]
+    for upload in request.files.getlist('images'):
+        sources.append((upload.filename, np.frombuffer(upload.read(), dtype=np.uint8)))
+
+    if not sources:
+        return jsonify({"error": "No image_paths or images provided"}), 400
+    if not (models.is_ready('classifier') and models.is_ready('embedder')):
+        return jsonify({"error": "Models are still loading", "models": models.status()}), 503
+
+    # One index snapshot for the whole request, so every line is matched against the same registry
+    index = owner_index
+    animal_type = data.get('animal_type') or request.form.get('animal_type')
+    if animal_type in index.partitions:
+        index = index.partitions[animal_type]
+
+    def load(source, encoded):
+        image = cv2.imread(source) if encoded is None else cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Image not found" if encoded is None and not os.path.exists(source) else "Could not read image")
+        return remove_green_border(image)
+
+    def generate():
+        for batch_start in range(0, len(sources), MATCH_BATCH_SIZE):
+            crops = []
+            for offset, (source, encoded) in enumerate(sources[batch_start:batch_start + MATCH_BATCH_SIZE]):
+                try:
+                    crops.append((batch_start + offset, source, load(source, encoded)))
+                except Exception as e:
+                    yield json.dumps({"index": batch_start + offset, "source": source, "error": str(e)}) + "\n"
+            if not crops:
+                continue
+
+            # The classifier model belongs to the stray-classifier batcher's worker thread
+            predictions = [stray_classifier.submit(preprocess_image(crop)[0]) for _, _, crop in crops]
+            with ThreadPoolExecutor(max_workers=len(crops)) as pool:
+                matches = [pool.submit(match_snapshot_to_owner, crop, index=index,
+                                       embed_fn=lambda img: embedding_batcher.submit(img).result())
+                           for _, _, crop in crops]
+
+                for (position, source, _), prediction, matched in zip(crops, predictions, matches):
+                    yield json.dumps(batch_result(position, source, prediction, matched)) + "\n"
+
+    def batch_result(position, source, prediction, matched):
+        stray_score = float(np.ravel(prediction.result())[0])
+        result = {
+            "index": position,
+            "source": source,
+            "predicted_label": "stray" if stray_score >= 0.3 else "not_stray",
+            "stray_score": stray_score
+        }
+        try:
+            match_result = matched.result() or {}
+            result.update({
+                "match": match_result.get('match'),
+                "score": float(match_result.get('score', 0)),
+                "method": match_result.get('method', 'none'),
+                "top_matches": [{
+                    "filename": m['filename'],
+                    "combined_score": float(m['combined_score']),
+                    "method": m['method']
+                } for m in match_result.get('all_matches', [])[:5]]
+            })
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api2/test-notification', methods=['GET'])
 def test_notification():
     """
@@ -2185,9 +2883,24 @@ def test_notification():
     })
 
 if __name__ == '__main__':
+    if '--build-owner-index' in sys.argv:
+        # Prebuild OWNER_INDEX_FILE before starting WSGI workers, which then only map (or update) it
+        if not OWNER_INDEX_FILE:
+            sys.exit("--build-owner-index needs OWNER_INDEX_FILE")
+        models.start()
+        precompute_owner_embeddings()
+        sys.exit(0 if file_stamp(OWNER_INDEX_FILE) else 1)
+
     # Initialize the pet database
     print("Initializing pet database...")
-    precompute_owner_embeddings()
+    if MATCH_WORKERS > 0:
+        # MatchPool forks its workers right away, before any thread exists: the batchers and the analysis pool
+        # only start their threads on first use, and the models, cameras and Flask all start below
+        match_pool = MatchPool(MATCH_WORKERS, MATCH_POOL_DIR)
+        print(f"Started {MATCH_WORKERS} matching worker processes")
+    models.start()
+    # The index needs the embedder, so it is built in the background while the cameras start
+    threading.Thread(target=load_owner_registry, daemon=True).start()
     
     for ip in STREAM_IP_RANGE:
         stream_id = f'cam-{ip}'
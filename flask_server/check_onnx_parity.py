@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Check the ONNX Runtime exports against the Keras models they were exported from
+#
+# Runs the stray classifier (model.h5) and the selected embedding backbones
+# through both runtimes on the same crops and reports the largest output
+# difference, agreement of the stray/not-stray decisions, the lowest TF/ONNX
+# embedding cosine similarity and the time per crop. Exits with status 1 if any model is
+# outside the tolerances, so it can gate a deployment with
+# INFERENCE_RUNTIME=onnx. Missing exports are created in --onnx-dir.
+#
+# Crops are read from venv/debug (the server's saved detections); random
+# images are used if there are none.
+#
+# Usage:
+#   python check_onnx_parity.py
+#   python check_onnx_parity.py --backends resnet50 mobilenet_v3_small --images venv/debug/cam3
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from embedding_backends import BACKENDS, EmbeddingBackend
+from onnx_models import load_onnx_model
+
+STRAY_THRESHOLD = 0.3  # Score at which besttrial.classify_and_match calls a crop a stray
+
+
+def load_crops(directory, limit):
+    crops = []
+    for root, _, files in sorted(os.walk(directory)):
+        for fname in sorted(files):
+            if fname.lower().endswith(('.jpg', '.jpeg', '.png')):
+                img = cv2.imread(os.path.join(root, fname))
+                if img is not None:
+                    crops.append(img)
+                if len(crops) >= limit:
+                    return crops
+    return crops
+
+
+def classifier_batch(crops):
+    # Same preprocessing as besttrial.preprocess_image
+    return np.stack([cv2.resize(img, (128, 128)) / 255.0 for img in crops]).astype(np.float32)
+
+
+def timed(fn, batch):
+    fn(batch[:1])  # Warm-up
+    start = time.perf_counter()
+    outputs = fn(batch)
+    return outputs, (time.perf_counter() - start) * 1000 / len(batch)
+
+
+def check_classifier(model_path, onnx_dir, crops, threads, tolerance):
+    import tensorflow as tf
+
+    keras_model = tf.keras.models.load_model(model_path)
+    onnx_model = load_onnx_model(os.path.join(onnx_dir, "model.onnx"), lambda: keras_model, threads, source_path=model_path)
+    batch = classifier_batch(crops)
+    expected, tf_ms = timed(lambda b: keras_model.predict(b, verbose=0), batch)
+    actual, onnx_ms = timed(onnx_model.predict, batch)
+
+    max_diff = float(np.abs(expected - actual).max())
+    agreement = float(np.mean((expected[:, 0] >= STRAY_THRESHOLD) == (actual[:, 0] >= STRAY_THRESHOLD)))
+    print(f"{'model.h5':<22}{'max |diff|':>14}{max_diff:>12.2e}{'stray agree':>14}{agreement:>8.3f}"
+          f"{tf_ms:>10.1f}{onnx_ms:>10.1f}")
+    return max_diff <= tolerance and agreement == 1.0
+
+
+def check_backend(name, onnx_dir, crops, threads, min_cosine):
+    tf_backend = EmbeddingBackend(name, 'tf')
+    onnx_backend = EmbeddingBackend(name, 'onnx', onnx_dir, threads)
+    expected, tf_ms = timed(tf_backend.embed_batch, crops)
+    actual, onnx_ms = timed(onnx_backend.embed_batch, crops)
+
+    max_diff = float(np.abs(expected - actual).max())
+    cosine = np.sum(expected * actual, axis=1) / (
+        np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1) + 1e-12)
+    print(f"{name:<22}{'max |diff|':>14}{max_diff:>12.2e}{'min cosine':>14}{cosine.min():>8.4f}"
+          f"{tf_ms:>10.1f}{onnx_ms:>10.1f}")
+    return float(cosine.min()) >= min_cosine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ONNX Runtime exports with the Keras models")
+    parser.add_argument('--model', default="model.h5", help="Stray classifier Keras model")
+    parser.add_argument('--backends', nargs='+', default=['resnet50'], choices=list(BACKENDS))
+    parser.add_argument('--onnx-dir', default=os.path.join("venv", "onnx"), help="Where the exports are kept")
+    parser.add_argument('--images', default=os.path.join("venv", "debug"), help="Directory of crops to compare on")
+    parser.add_argument('--limit', type=int, default=64, help="Most crops used")
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime intra-op threads, 0 uses every core")
+    parser.add_argument('--tolerance', type=float, default=1e-3, help="Largest allowed classifier output difference")
+    parser.add_argument('--min-cosine', type=float, default=0.999, help="Lowest allowed TF/ONNX embedding cosine")
+    args = parser.parse_args()
+
+    crops = load_crops(args.images, args.limit)
+    if not crops:
+        print(f"No crops found in {args.images}, using random images")
+        rng = np.random.default_rng(0)
+        crops = list(rng.integers(0, 256, size=(args.limit, 224, 224, 3), dtype=np.uint8))
+    print(f"Comparing on {len(crops)} crops")
+    print(f"{'model':<22}{'':>26}{'':>22}{'TF ms':>10}{'ONNX ms':>10}")
+
+    ok = check_classifier(args.model, args.onnx_dir, crops, args.threads, args.tolerance)
+    for name in args.backends:
+        ok = check_backend(name, args.onnx_dir, crops, args.threads, args.min_cosine) and ok
+    print("Parity OK" if ok else "Parity FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+RT-DETR detection backend that runs with or without a GPU.
+
+With CUDA available, best.pt runs on the GPU through PyTorch as before.
+Otherwise it is exported once with ultralytics to a CPU inference engine
+(ONNX Runtime or OpenVINO) and the export is used instead; plain PyTorch on
+the CPU is also available. Exports are made for one input size, so they are
+kept per resolution in `export_dir` (best-640x352.onnx, ...).
+
+The inference resolution can be set below the camera frame size to trade
+some small-object recall for speed. Boxes are always returned in the
+coordinates of the frame that was passed in. Compare the resolutions with
+bench_detection.py.
+"""
+import os
+import shutil
+
+from owner_index import file_sha1
+
+DEVICES = ('auto', 'cuda', 'cpu')
+CPU_FORMATS = ('onnx', 'openvino', 'pytorch')
+
+
+def parse_resolution(value):
+    """"960x544" -> (960, 544) as (width, height)"""
+    width, height = (int(v) for v in value.lower().split('x'))
+    return width, height
+
+
+def result_boxes(results):
+    """ultralytics Results -> [(class_id, confidence, (x1, y1, x2, y2)), ...] with integer pixel corners"""
+    boxes = []
+    for result in results:
+        for box in result.boxes:
+            boxes.append((int(box.cls.item()), box.conf.item(), tuple(map(int, box.xyxy[0]))))
+    return boxes
+
+
+def select_device(preference='auto'):
+    """'cuda' if requested (or auto) and available, otherwise 'cpu'"""
+    if preference not in DEVICES:
+        raise ValueError(f"Unknown detection device '{preference}', expected one of: {', '.join(DEVICES)}")
+    if preference == 'cpu':
+        return 'cpu'
+    import torch
+    if torch.cuda.is_available():
+        return 'cuda'
+    if preference == 'cuda':
+        print("Warning: DETECT_DEVICE=cuda but CUDA is not available, detecting on the CPU")
+    return 'cpu'
+
+
+def export_path(weights, export_dir, cpu_format, resolution):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    suffix = '.onnx' if cpu_format == 'onnx' else '_openvino_model'
+    return os.path.join(export_dir, f"{stem}-{resolution[0]}x{resolution[1]}{suffix}")
+
+
+def export_detector(weights, path, cpu_format, resolution):
+    """Export `weights` for a (width, height) input to `path` with a dynamic batch axis"""
+    from ultralytics import RTDETR
+
+    exported = RTDETR(weights).export(format=cpu_format, imgsz=(resolution[1], resolution[0]), dynamic=True)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    shutil.move(str(exported), path)
+
+
+class DetectionBackend:
+    """RT-DETR on CUDA, or an exported CPU engine, predicting at a fixed resolution"""
+
+    def __init__(self, weights='best.pt', resolution=(960, 544), device='auto', cpu_format='onnx',
+                 export_dir=os.path.join("venv", "detector")):
+        """
+        Args:
+            weights: RT-DETR .pt file
+            resolution: (width, height) the frames are resized to for inference, multiples of 32
+            device: "auto" (CUDA if available), "cuda" or "cpu"
+            cpu_format: engine used without CUDA: "onnx", "openvino" or "pytorch"
+            export_dir: where CPU exports are kept
+        """
+        from ultralytics import RTDETR
+
+        if cpu_format not in CPU_FORMATS:
+            raise ValueError(f"Unknown detector CPU format '{cpu_format}', expected one of: {', '.join(CPU_FORMATS)}")
+        self.weights = weights
+        self.resolution = resolution
+        self.device = select_device(device)
+        self.engine = 'pytorch' if self.device == 'cuda' else cpu_format
+
+        if self.engine == 'pytorch':
+            self.model = RTDETR(weights)
+            self.model.to(self.device)
+        else:
+            path = export_path(weights, export_dir, self.engine, resolution)
+            if not os.path.exists(path) or os.path.getmtime(weights) > os.path.getmtime(path):
+                print(f"Exporting {weights} to {path} for CPU inference")
+                export_detector(weights, path, self.engine, resolution)
+            self.model = RTDETR(path)
+        print(f"Detector: {weights} on {self.device} ({self.engine}, {resolution[0]}x{resolution[1]})")
+
+    def predict(self, frames, **kwargs):
+        """ultralytics Results for one frame or a list of frames"""
+        # ultralytics takes imgsz as (height, width)
+        return self.model.predict(frames, imgsz=(self.resolution[1], self.resolution[0]), device=self.device,
+                                  verbose=False, **kwargs)
+
+    def cache_key(self):
+        """Identifies what the boxes depend on: the weights' content, the engine and the resolution"""
+        return f"{file_sha1(self.weights)[:12]}-{self.engine}-{self.resolution[0]}x{self.resolution[1]}"
+
+    def describe(self):
+        return {'device': self.device, 'engine': self.engine, 'resolution': f"{self.resolution[0]}x{self.resolution[1]}"}
@@ -0,0 +1,117 @@
+"""
+Persistent detection cache for the looping demo videos.
+
+The static demo streams play the same video files over and over, so RT-DETR
+would see exactly the same frames on every loop. Their detector boxes are
+kept per (video file hash, frame index, model key), along with the boxes
+carried forward on frames the motion gate skipped: the first pass through a
+video fills the cache, later loops (and restarts) replay the cached boxes
+without running the detector. The model key covers the weights, engine and
+inference resolution (DetectionBackend.cache_key), so a new best.pt or a
+different DETECT_RESOLUTION starts a fresh cache.
+
+One JSON file per video and model is kept in `cache_dir`, written atomically
+(next to it, then os.replace) when a loop of the video completes and every
+`save_every` new frames.
+
+Boxes are (class_id, confidence, (x1, y1, x2, y2)) tuples, as returned by
+detection_backend.result_boxes.
+"""
+import json
+import os
+import threading
+
+from owner_index import file_sha1
+
+FORMAT_VERSION = 1
+
+
+class DetectionCache:
+    """Detector boxes of one video's frames for one model, loaded from and saved to disk"""
+
+    def __init__(self, cache_dir, video_path, model_key, save_every=500):
+        """
+        Args:
+            cache_dir: directory of the cache files
+            video_path: the looping video; its content hash is part of the key
+            model_key: identifies the detector weights, engine and resolution
+            save_every: new frames after which the cache is written even mid-loop
+        """
+        self.video_path = video_path
+        self.video_hash = file_sha1(video_path)
+        self.model_key = model_key
+        self.save_every = save_every
+        self.path = os.path.join(cache_dir, f"{self.video_hash[:16]}-{model_key}.json")
+        self.frames = {}
+        self.unsaved = 0
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') != FORMAT_VERSION or data.get('video') != self.video_hash \
+                    or data.get('model') != self.model_key:
+                print(f"Ignoring detection cache {self.path}: written for another video or model")
+                return
+            self.frames = {
+                int(index): [(class_id, confidence, tuple(box)) for class_id, confidence, box in boxes]
+                for index, boxes in data['frames'].items()
+            }
+            print(f"Detection cache: {len(self.frames)} frames of {self.video_path} from {self.path}")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable detection cache {self.path}: {e}")
+
+    def get(self, frame_index):
+        """Cached boxes of a frame, or None if it was never detected"""
+        boxes = self.frames.get(frame_index)
+        with self.lock:
+            if boxes is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return boxes
+
+    def put(self, frame_index, boxes):
+        self.frames[frame_index] = list(boxes)
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        """Write the cache if it has new frames"""
+        if not self.unsaved:
+            return
+        data = {
+            'version': FORMAT_VERSION,
+            'video': self.video_hash,
+            'model': self.model_key,
+            'frames': {str(index): [[class_id, confidence, list(box)] for class_id, confidence, box in boxes]
+                       for index, boxes in self.frames.items()}
+        }
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            self.unsaved = 0
+        except OSError as e:
+            print(f"Failed to save detection cache {self.path}: {e}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'frames': len(self.frames),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'model': self.model_key
+            }
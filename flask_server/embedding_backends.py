@@ -0,0 +1,108 @@
+"""
+Selectable image-embedding backbones for owner matching.
+
+Every backend is an ImageNet Keras application without its classifier,
+global-average pooled into one vector per image. ResNet50 (2048-d) is the
+original backbone; the MobileNetV3 and EfficientNet backends are several
+times cheaper per crop on CPU with smaller (576 to 1280-d) embeddings.
+Embeddings of different backends are not comparable, so the registry is
+embedded and cached separately per backend (see EMBEDDING_BACKEND in
+besttrial.py). Compare them with eval_embedding_backends.py.
+
+With runtime="onnx" the backbone is exported once to `onnx_dir` and run by
+ONNX Runtime (see onnx_models.py); Keras is only needed for the export.
+runtime="onnx-int8" runs the INT8 model built by quantize_models.py.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from onnx_models import load_onnx_model
+
+RUNTIMES = ('tf', 'onnx', 'onnx-int8')
+
+# keras.applications.resnet50.preprocess_input ("caffe" mode): RGB to BGR, minus the ImageNet channel means
+IMAGENET_BGR_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def caffe_preprocess(batch):
+    return batch[..., ::-1] - IMAGENET_BGR_MEAN
+
+
+def _resnet50():
+    from keras.applications.resnet50 import ResNet50
+    return ResNet50(weights='imagenet', include_top=False, pooling='avg')
+
+
+def _mobilenet_v3_small():
+    from keras.applications import MobileNetV3Small
+    # The MobileNetV3 models rescale 0-255 RGB input themselves
+    return MobileNetV3Small(weights='imagenet', include_top=False, pooling='avg', input_shape=(224, 224, 3))
+
+
+def _mobilenet_v3_large():
+    from keras.applications import MobileNetV3Large
+    return MobileNetV3Large(weights='imagenet', include_top=False, pooling='avg', input_shape=(224, 224, 3))
+
+
+def _efficientnet_b0():
+    from keras.applications import EfficientNetB0
+    # EfficientNet also normalizes 0-255 RGB input inside the model
+    return EfficientNetB0(weights='imagenet', include_top=False, pooling='avg')
+
+
+# name -> loader returning the Keras model
+BACKENDS = {
+    'resnet50': _resnet50,
+    'mobilenet_v3_small': _mobilenet_v3_small,
+    'mobilenet_v3_large': _mobilenet_v3_large,
+    'efficientnet_b0': _efficientnet_b0,
+}
+
+# name -> preprocessing of the 0-255 RGB batch, for backends that do not normalize inside the model
+PREPROCESS = {
+    'resnet50': caffe_preprocess,
+}
+
+INPUT_SIZE = 224
+
+
+def input_batch(name, imgs):
+    """Model input for BGR (OpenCV) images: resized 0-255 RGB, preprocessed as backend `name` expects"""
+    batch = np.stack([cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (INPUT_SIZE, INPUT_SIZE))
+                      for img in imgs]).astype('float32')
+    return PREPROCESS[name](batch) if name in PREPROCESS else batch
+
+
+class EmbeddingBackend:
+    """A loaded backbone that embeds BGR (OpenCV) crops"""
+
+    def __init__(self, name, runtime='tf', onnx_dir=None, threads=0):
+        """
+        Args:
+            name: one of BACKENDS
+            runtime: "tf" runs the Keras model, "onnx" its ONNX export (see onnx_models.py)
+                and "onnx-int8" the quantized export
+            onnx_dir: where the ONNX export is kept, as <name>.onnx
+            threads: ONNX Runtime intra-op threads, 0 uses every available core
+        """
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{name}', expected one of: {', '.join(BACKENDS)}")
+        if runtime not in RUNTIMES:
+            raise ValueError(f"Unknown inference runtime '{runtime}', expected one of: {', '.join(RUNTIMES)}")
+        self.name = name
+        self.runtime = runtime
+        if runtime in ('onnx', 'onnx-int8'):
+            self.model = load_onnx_model(os.path.join(onnx_dir, f"{name}.onnx"), BACKENDS[name], threads,
+                                         int8=runtime == 'onnx-int8')
+        else:
+            self.model = BACKENDS[name]()
+        self.dim = int(self.model.output_shape[-1])
+
+    def embed(self, img):
+        return self.model.predict(input_batch(self.name, [img]), verbose=0)[0]
+
+    def embed_batch(self, imgs):
+        """Embed several images with one model call"""
+        return self.model.predict(input_batch(self.name, imgs), verbose=0)
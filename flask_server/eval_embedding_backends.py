@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# Compare embedding backends on the pet registry: top-1/top-5 match accuracy and latency
+#
+# Registry photos are grouped by pet ID with the {filename: pet_id} metadata
+# file (--pets, see PET_METADATA in README.md). Every photo of a pet with two or more photos is used as a
+# query against all other registry photos (leave-one-out); a hit means the
+# nearest other photo belongs to the same pet. With --queries, camera crops
+# are used instead, sorted into one sub-directory per registry pet ID
+# (e.g. venv/eval_crops/max/cam3_dog1.jpg).
+#
+# Latency is the time to embed one crop (batch of 1), as in the matcher's
+# fallback stage; the registry is embedded in batches.
+#
+# Usage:
+#   python eval_embedding_backends.py
+#   python eval_embedding_backends.py --registry /home/straysafe/venv/with_leash --backends resnet50 mobilenet_v3_small
+#   python eval_embedding_backends.py --queries venv/eval_crops
+
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from embedding_backends import BACKENDS, EmbeddingBackend
+from owner_index import EmbeddingMatrix, list_registry_images
+from pet_gallery import PetIds
+
+
+def load_images(directory):
+    images = {}
+    for fname in list_registry_images(directory):
+        img = cv2.imread(os.path.join(directory, fname))
+        if img is not None:
+            images[fname] = img
+    return images
+
+
+def embed_all(backend, images, batch_size):
+    names = list(images)
+    embeddings = []
+    for start in range(0, len(names), batch_size):
+        embeddings.append(backend.embed_batch([images[f] for f in names[start:start + batch_size]]))
+    return EmbeddingMatrix(names, np.vstack(embeddings)) if embeddings else EmbeddingMatrix()
+
+
+def evaluate(backend_name, registry, queries, pet_id_fn, batch_size, latency_samples):
+    start = time.perf_counter()
+    backend = EmbeddingBackend(backend_name)
+    load_s = time.perf_counter() - start
+
+    backend.embed(next(iter(registry.values())))  # Warm-up, the first call builds the graph
+    start = time.perf_counter()
+    index = embed_all(backend, registry, batch_size)
+    registry_s = time.perf_counter() - start
+
+    top1 = top5 = total = 0
+    latencies = []
+    for fname, (img, pet_id) in queries.items():
+        start = time.perf_counter()
+        query = backend.embed(img)
+        if len(latencies) < latency_samples:
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        # Leave-one-out: never count the query photo itself
+        results = [(name, sim) for name, sim in index.search(query, k=6) if name != fname][:5]
+        pets = [pet_id_fn(name) for name, _ in results]
+        top1 += bool(pets) and pets[0] == pet_id
+        top5 += pet_id in pets
+        total += 1
+
+    return {
+        'backend': backend_name,
+        'dim': backend.dim,
+        'top1': top1 / total if total else 0.0,
+        'top5': top5 / total if total else 0.0,
+        'queries': total,
+        'ms_per_crop': float(np.median(latencies)) if latencies else 0.0,
+        'registry_s': registry_s,
+        'load_s': load_s,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on the pet registry")
+    parser.add_argument('--registry', default="/home/straysafe/venv/with_leash", help="Registry image directory")
+    parser.add_argument('--pets', help="{filename: pet_id} metadata of the registry (default: <registry>/pets.json)")
+    parser.add_argument('--queries', help="Directory with one sub-directory of crops per registry pet ID (default: leave-one-out)")
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--batch-size', type=int, default=32, help="Batch size for embedding the registry")
+    parser.add_argument('--latency-samples', type=int, default=100, help="Queries timed for the per-crop latency")
+    args = parser.parse_args()
+
+    registry = load_images(args.registry)
+    if not registry:
+        print(f"No registry images found in {args.registry}")
+        return
+
+    pet_id_fn = PetIds(args.pets or os.path.join(args.registry, "pets.json"))
+    if args.queries:
+        queries = {}
+        for pet_id in sorted(os.listdir(args.queries)):
+            pet_dir = os.path.join(args.queries, pet_id)
+            if os.path.isdir(pet_dir):
+                queries.update({os.path.join(pet_id, f): (img, pet_id) for f, img in load_images(pet_dir).items()})
+    else:
+        counts = {}
+        for fname in registry:
+            counts[pet_id_fn(fname)] = counts.get(pet_id_fn(fname), 0) + 1
+        queries = {f: (img, pet_id_fn(f)) for f, img in registry.items() if counts[pet_id_fn(f)] > 1}
+    if not queries:
+        print("No queries: no pet has more than one photo in the pet metadata, use --pets or --queries")
+        return
+
+    print(f"Registry: {len(registry)} images of {len({pet_id_fn(f) for f in registry})} pets, "
+          f"{len(queries)} queries")
+    print(f"{'backend':<22}{'dim':>6}{'top-1':>8}{'top-5':>8}{'ms/crop':>10}{'registry s':>12}")
+    for backend_name in args.backends:
+        r = evaluate(backend_name, registry, queries, pet_id_fn, args.batch_size, args.latency_samples)
+        print(f"{r['backend']:<22}{r['dim']:>6}{r['top1']:>8.3f}{r['top5']:>8.3f}"
+              f"{r['ms_per_crop']:>10.1f}{r['registry_s']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
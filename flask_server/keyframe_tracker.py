@@ -0,0 +1,209 @@
+"""
+Keyframe detection with box propagation between detector runs.
+
+Instead of running RT-DETR on every frame, a stream can run it on
+keyframes only: every `interval` frames, or adaptively, more often when
+tracked animals move fast or there are many of them and up to
+`max_interval` frames apart when they are slow. In between, the last
+detector boxes are moved with a lightweight motion model, so the trackers
+and the HLS overlay still get a box on every frame:
+  - "flow": sparse Lucas-Kanade optical flow of corner features inside each
+    box; the box is shifted by their median displacement
+  - "kalman": a constant-velocity Kalman filter per box, corrected on every
+    keyframe and predicted on the frames between
+Box sizes and confidences are those of the last keyframe.
+
+Boxes are (class_id, confidence, (x1, y1, x2, y2)) tuples, as returned by
+detection_backend.result_boxes.
+"""
+import threading
+
+import cv2
+import numpy as np
+
+PROPAGATION_METHODS = ('flow', 'kalman')
+
+
+def _center(box):
+    x1, y1, x2, y2 = box
+    return (x1 + x2) / 2, (y1 + y2) / 2
+
+
+def _moved(box, dx, dy, width, height):
+    """Box shifted by (dx, dy), kept inside the frame"""
+    x1, y1, x2, y2 = box
+    dx = min(max(dx, -x1), width - 1 - x2)
+    dy = min(max(dy, -y1), height - 1 - y2)
+    return int(round(x1 + dx)), int(round(y1 + dy)), int(round(x2 + dx)), int(round(y2 + dy))
+
+
+def _kalman(center):
+    """Constant-velocity filter over (cx, cy, vx, vy) measuring (cx, cy), one step per frame"""
+    kf = cv2.KalmanFilter(4, 2)
+    kf.transitionMatrix = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=np.float32)
+    kf.measurementMatrix = np.eye(2, 4, dtype=np.float32)
+    kf.processNoiseCov = np.eye(4, dtype=np.float32) * 1e-2
+    kf.measurementNoiseCov = np.eye(2, dtype=np.float32) * 1.0
+    kf.errorCovPost = np.eye(4, dtype=np.float32) * 10.0
+    kf.statePost = np.array([[center[0]], [center[1]], [0], [0]], dtype=np.float32)
+    return kf
+
+
+class KeyframeTracker:
+    """Decides which of one stream's frames are detected and propagates boxes over the others"""
+
+    def __init__(self, interval=1, adaptive=False, max_interval=10, method='flow', max_drift=0.1):
+        """
+        Args:
+            interval: detect every `interval` frames (1 detects every frame); the shortest interval when adaptive
+            adaptive: pick the interval from the tracked boxes' speed and count
+            max_interval: longest adaptive interval, used when nothing is tracked or boxes barely move
+            method: "flow" or "kalman" box propagation
+            max_drift: adaptive only; how far (as a fraction of its size) a box may move between keyframes
+        """
+        if method not in PROPAGATION_METHODS:
+            raise ValueError(f"Unknown box propagation '{method}', expected one of: {', '.join(PROPAGATION_METHODS)}")
+        self.interval = max(1, interval)
+        self.adaptive = adaptive
+        self.max_interval = max(self.interval, max_interval)
+        self.method = method
+        self.max_drift = max_drift
+        # With a fixed interval of 1 every frame is a keyframe, so nothing is ever propagated
+        self.propagates = self.interval > 1 or adaptive
+
+        self.current_interval = self.interval
+        self.since_keyframe = None  # Frames since the last keyframe, None before the first
+        self.boxes = []
+        self.keyframe_boxes = []  # Detector boxes of the last keyframe
+        self.speeds = []  # Per box: center movement per frame, as a fraction of the box diagonal
+        self.filters = []  # "kalman": one filter per box
+        self.prev_gray = None  # "flow": previous frame and the tracked points of every box
+        self.points = []
+
+        self.lock = threading.Lock()
+        self.keyframes = 0
+        self.propagated = 0
+
+    def is_keyframe(self):
+        """Whether the next frame should go to the detector"""
+        return self.since_keyframe is None or self.since_keyframe + 1 >= self.current_interval
+
+    def update(self, frame, boxes):
+        """Record the detector boxes of a keyframe"""
+        if self.propagates:
+            elapsed = (self.since_keyframe or 0) + 1
+            self.speeds = [self._speed(box, self.keyframe_boxes, elapsed) for box in boxes]
+            if self.method == 'kalman':
+                self.filters = self._correct_filters(boxes)
+            else:
+                self.prev_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self.points = [self._features(self.prev_gray, box[2]) for box in boxes]
+        self.boxes = list(boxes)
+        self.keyframe_boxes = list(boxes)
+        self.since_keyframe = 0
+        self.current_interval = self._next_interval()
+        with self.lock:
+            self.keyframes += 1
+
+    def propagate(self, frame):
+        """Boxes of the last keyframe moved to `frame`"""
+        if self.since_keyframe is not None:
+            self.since_keyframe += 1
+        if not self.boxes:
+            return []
+        height, width = frame.shape[:2]
+        if self.method == 'kalman':
+            moved = []
+            for (class_id, confidence, box), kf in zip(self.boxes, self.filters):
+                cx, cy = kf.predict()[:2, 0]
+                old_cx, old_cy = _center(box)
+                moved.append((class_id, confidence, _moved(box, cx - old_cx, cy - old_cy, width, height)))
+        else:
+            moved = self._flow(frame, width, height)
+        self.boxes = moved
+        with self.lock:
+            self.propagated += 1
+        return moved
+
+    def _features(self, gray, box):
+        x1, y1, x2, y2 = box
+        mask = np.zeros_like(gray)
+        mask[max(y1, 0):y2, max(x1, 0):x2] = 255
+        return cv2.goodFeaturesToTrack(gray, maxCorners=30, qualityLevel=0.01, minDistance=5, mask=mask)
+
+    def _flow(self, frame, width, height):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        moved, points = [], []
+        for (class_id, confidence, box), prev_points in zip(self.boxes, self.points):
+            dx = dy = 0.0
+            if prev_points is not None and len(prev_points):
+                next_points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, prev_points, None)
+                found = status.ravel() == 1
+                if found.any():
+                    dx, dy = np.median((next_points - prev_points)[found].reshape(-1, 2), axis=0)
+                    prev_points = next_points[found].reshape(-1, 1, 2)
+                else:
+                    prev_points = None
+            moved.append((class_id, confidence, _moved(box, dx, dy, width, height)))
+            points.append(prev_points)
+        self.prev_gray, self.points = gray, points
+        return moved
+
+    def _nearest(self, box, previous):
+        """Index of the previous box of the same class closest to `box`, or None"""
+        class_id, _, coords = box
+        center = _center(coords)
+        best, best_distance = None, None
+        for i, (prev_class, _, prev_coords) in enumerate(previous):
+            if prev_class != class_id:
+                continue
+            prev_center = _center(prev_coords)
+            distance = np.hypot(center[0] - prev_center[0], center[1] - prev_center[1])
+            if best_distance is None or distance < best_distance:
+                best, best_distance = i, distance
+        return best
+
+    def _speed(self, box, previous, elapsed):
+        i = self._nearest(box, previous)
+        if i is None:
+            return 0.0
+        x1, y1, x2, y2 = box[2]
+        (cx, cy), (px, py) = _center(box[2]), _center(previous[i][2])
+        return float(np.hypot(cx - px, cy - py)) / elapsed / max(np.hypot(x2 - x1, y2 - y1), 1.0)
+
+    def _correct_filters(self, boxes):
+        """Per detection, the filter of the nearest propagated box stepped to this frame and corrected, or a new one"""
+        filters, used = [], set()
+        for box in boxes:
+            center = np.array(_center(box[2]), dtype=np.float32).reshape(2, 1)
+            i = self._nearest(box, self.boxes)
+            if i is None or i in used:
+                filters.append(_kalman(center.ravel()))
+                continue
+            used.add(i)
+            kf = self.filters[i]
+            kf.predict()
+            kf.correct(center)
+            filters.append(kf)
+        return filters
+
+    def _next_interval(self):
+        if not self.adaptive:
+            return self.interval
+        if not self.boxes:
+            return self.max_interval
+        # Frames until the fastest box has moved max_drift of its size, shortened when many animals are tracked
+        fastest = max(self.speeds) if self.speeds else 0.0
+        frames = self.max_drift / fastest if fastest > 0 else self.max_interval
+        frames /= np.sqrt(len(self.boxes))
+        return int(min(max(frames, self.interval), self.max_interval))
+
+    def stats(self):
+        with self.lock:
+            frames = self.keyframes + self.propagated
+            return {
+                'keyframes': self.keyframes,
+                'propagated': self.propagated,
+                'detect_ratio': self.keyframes / frames if frames else 0.0,
+                'interval': self.current_interval
+            }
@@ -0,0 +1,156 @@
+"""
+Process pool for the CPU-heavy visual stages of owner matching.
+
+The owner index arrays (colour histograms, packed ORB descriptors and their
+offsets) are written once per index version to a snapshot directory of .npy
+files. Worker processes open them with mmap, so every worker shares the same
+page cache instead of holding its own copy. Each match is split into one
+shard of registry rows per worker; a worker scores the colour correlation of
+its shard, keeps its local top-K and runs the bulk ORB cross-check on those.
+The parent merges the shards and keeps the global top-K, which is exactly
+the candidate set a single-process search would pick.
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from orb_hamming import cross_check_match, summarize_matches
+from owner_index import correlation_rows
+
+# Index versions whose snapshots are kept on disk; the previous version may still be read by in-flight
+# matches. A version has one snapshot for the whole index plus one per species partition.
+KEEP_VERSIONS = 2
+
+# Snapshots mapped by this worker process, keyed by directory, least recently used first
+_worker_snapshots = OrderedDict()
+MAX_WORKER_SNAPSHOTS = 8
+
+
+def write_index_snapshot(index, root_dir):
+    """Write the arrays the workers need for `index` to a new directory under root_dir"""
+    snapshot_dir = os.path.join(root_dir, f"index-{uuid.uuid4().hex[:12]}")
+    os.makedirs(snapshot_dir)
+    np.save(os.path.join(snapshot_dir, 'histograms.npy'), index.histograms)
+    np.save(os.path.join(snapshot_dir, 'descriptors.npy'), index.descriptors.descriptors)
+    np.save(os.path.join(snapshot_dir, 'offsets.npy'), index.descriptors.offsets)
+    with open(os.path.join(snapshot_dir, 'names.json'), 'w') as f:
+        json.dump(index.names, f)
+    return snapshot_dir
+
+
+def _load_snapshot(snapshot_dir):
+    snapshot = _worker_snapshots.get(snapshot_dir)
+    if snapshot is None:
+        snapshot = {
+            name: np.load(os.path.join(snapshot_dir, f"{name}.npy"), mmap_mode='r')
+            for name in ('histograms', 'descriptors', 'offsets')
+        }
+        _worker_snapshots[snapshot_dir] = snapshot
+        # Drop the mappings of older versions; the current one's partitions are used in turn
+        while len(_worker_snapshots) > MAX_WORKER_SNAPSHOTS:
+            _worker_snapshots.popitem(last=False)
+    else:
+        _worker_snapshots.move_to_end(snapshot_dir)
+    return snapshot
+
+
+def score_rows(histograms, descriptors, offsets, rows, query_corr, query_descriptors, top_k, good_threshold):
+    """
+    Colour correlation for `rows`, then bulk ORB cross-check on the top_k best coats.
+
+    Returns (rows, color_sims, good_counts, avg_distances) for the kept rows,
+    ordered best colour first.
+    """
+    color_sims = np.asarray(histograms[rows]) @ query_corr
+    keep = np.arange(len(rows))
+    if 0 < top_k < len(rows):
+        keep = np.argpartition(-color_sims, top_k - 1)[:top_k]
+    keep = keep[np.argsort(-color_sims[keep], kind='stable')]
+    rows, color_sims = rows[keep], color_sims[keep]
+
+    good_counts = np.zeros(len(rows), dtype=np.int64)
+    avg_distances = np.zeros(len(rows))
+    if query_descriptors is not None and len(query_descriptors) > 10 and len(rows):
+        seg_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        seg_offsets[1:] = np.cumsum(offsets[rows + 1] - offsets[rows])
+        owner_descriptors = np.vstack([descriptors[offsets[r]:offsets[r + 1]] for r in rows])
+        pet_of_match, distances = cross_check_match(query_descriptors, owner_descriptors, seg_offsets)
+        good_counts, avg_distances = summarize_matches(
+            pet_of_match, distances, len(rows), top_n=30, good_threshold=good_threshold)
+    return rows, color_sims, good_counts, avg_distances
+
+
+def _score_shard(snapshot_dir, start, end, query_corr, query_descriptors, top_k, good_threshold):
+    snapshot = _load_snapshot(snapshot_dir)
+    rows = np.arange(start, end, dtype=np.int64)
+    return score_rows(snapshot['histograms'], snapshot['descriptors'], snapshot['offsets'],
+                      rows, query_corr, query_descriptors, top_k, good_threshold)
+
+
+class MatchPool:
+    """Fixed set of worker processes scoring registry shards in parallel"""
+
+    def __init__(self, workers, snapshot_root):
+        self.workers = workers
+        self.snapshot_root = snapshot_root
+        self.snapshots = []  # (version, directory), oldest first
+        shutil.rmtree(snapshot_root, ignore_errors=True)
+        os.makedirs(snapshot_root, exist_ok=True)
+        # fork: the workers only run NumPy code from this module, while spawn would
+        # re-run the server script (and its model loading) in every worker
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        # The executor only forks its workers on the first submit; fork them now, while the caller can still
+        # guarantee no other thread is running, instead of from a matching thread of the running server
+        self.executor.submit(int).result()
+
+    def publish(self, index, version):
+        """
+        Write a snapshot of `index` for the workers and return its directory.
+
+        Snapshots of the same index version (the whole index and its species partitions) share `version`;
+        every snapshot of the last KEEP_VERSIONS versions is kept.
+        """
+        snapshot_dir = write_index_snapshot(index, self.snapshot_root)
+        self.snapshots.append((version, snapshot_dir))
+        versions = list(dict.fromkeys(v for v, _ in self.snapshots))
+        while len(versions) > KEEP_VERSIONS:
+            oldest = versions.pop(0)
+            # Workers that still map an old snapshot keep reading it after the unlink
+            for v, old_dir in self.snapshots:
+                if v == oldest:
+                    shutil.rmtree(old_dir, ignore_errors=True)
+            self.snapshots = [(v, d) for v, d in self.snapshots if v != oldest]
+        return snapshot_dir
+
+    def score(self, snapshot_dir, num_rows, query_hist, query_descriptors, top_k, good_threshold):
+        """
+        Parallel equivalent of score_rows over every registry row.
+
+        Returns (rows, color_sims, good_counts, avg_distances), best colour first.
+        """
+        query_corr = correlation_rows([query_hist])[0]
+        bounds = np.linspace(0, num_rows, min(self.workers, max(num_rows, 1)) + 1).astype(int)
+        futures = [
+            self.executor.submit(_score_shard, snapshot_dir, start, end, query_corr,
+                                 query_descriptors, top_k, good_threshold)
+            for start, end in zip(bounds[:-1], bounds[1:]) if end > start
+        ]
+        parts = [f.result() for f in futures]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        rows, color_sims, good_counts, avg_distances = (np.concatenate(p) for p in zip(*parts))
+        # Every shard kept its own top_k, so the global top_k is among the merged rows
+        keep = np.argsort(-color_sims, kind='stable')
+        if top_k > 0:
+            keep = keep[:top_k]
+        return rows[keep], color_sims[keep], good_counts[keep], avg_distances[keep]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,107 @@
+"""
+Micro-batching of single-image model calls from many threads.
+
+Keras `predict` has a large fixed cost per call, and concurrent calls from the
+camera threads serialize on the model anyway. Callers submit one input and get
+a Future; a single worker thread collects queued inputs into batches of up to
+`max_batch`, waiting at most `max_wait` seconds after the first one arrives,
+runs one forward pass per batch and resolves every caller's Future with its
+own row of the output.
+
+The same worker batches RT-DETR frames across cameras; there `collate=list`
+passes the frames as a list, since the detector takes a list of images.
+
+The worker thread starts on the first submit(), so creating a batcher at
+import time leaves the process single-threaded (the server forks its
+matching processes after import).
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Single worker thread that batches submit() calls into one predict_fn call"""
+
+    def __init__(self, predict_fn, max_batch=16, max_wait=0.02, name="micro-batcher", collate=np.stack):
+        """
+        Args:
+            predict_fn: called with collate(inputs) of a batch, returns one output per input
+            max_batch: most inputs per forward pass
+            max_wait: seconds to wait for more inputs after the first one of a batch
+            collate: builds the batch from the list of inputs, stacked along a new axis by default
+        """
+        self.predict_fn = predict_fn
+        self.collate = collate
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.predict_seconds = 0.0
+        self.started = time.monotonic()
+        self.name = name
+        self.worker = None
+        self.start_lock = threading.Lock()
+
+    def submit(self, x):
+        """Queue one input (without the batch axis); the Future resolves to its output row"""
+        if self.worker is None:
+            with self.start_lock:
+                if self.worker is None:
+                    self.started = time.monotonic()
+                    self.worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self.worker.start()
+        future = Future()
+        self.queue.put((x, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(x, future) for x, future in self._collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                outputs = self.predict_fn(self.collate([x for x, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+            with self.stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.predict_seconds += time.perf_counter() - start
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+                'avg_batch_ms': self.predict_seconds / self.batches * 1000 if self.batches else 0.0,
+                # Share of the time since start the worker spent in predict_fn
+                'utilization': self.predict_seconds / max(time.monotonic() - self.started, 1e-9),
+                'queued': self.queue.qsize()
+            }
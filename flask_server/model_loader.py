@@ -0,0 +1,122 @@
+"""
+Background loading of the server's models with per-model readiness.
+
+Loading TensorFlow, the Keras models and RT-DETR takes long enough that the
+server used to stay dark for a while after every restart. Models are now
+registered with a loader function and loaded off the main thread, so the
+cameras and HLS output start right away. Code that needs a model either
+checks is_ready() and skips the work until then (the detector in the stream
+loops) or calls get(), which waits for it (classification and matching).
+
+Loading modes:
+  - "parallel": every model loads in its own thread as soon as start() is called
+  - "sequential": one thread loads the models in registration order
+  - "lazy": a model loads the first time it is asked for, by get(), is_ready() or all_ready()
+"""
+import threading
+import time
+
+LOADING_MODES = ('parallel', 'sequential', 'lazy')
+
+
+class ModelNotReady(RuntimeError):
+    """Raised by get() when a model failed to load, or is still loading at the timeout"""
+
+
+class _Slot:
+    def __init__(self, loader):
+        self.loader = loader
+        self.state = 'pending'  # pending -> loading -> ready | failed
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.done = threading.Event()
+
+
+class ModelLoader:
+    """Named models, each loaded once by its loader function"""
+
+    def __init__(self, mode='parallel'):
+        if mode not in LOADING_MODES:
+            raise ValueError(f"Unknown model loading mode '{mode}', expected one of: {', '.join(LOADING_MODES)}")
+        self.mode = mode
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, loader):
+        """Add a model; loader() is called once, in a background thread, and returns it"""
+        self.slots[name] = _Slot(loader)
+
+    def start(self):
+        """Begin loading according to the mode (nothing happens in lazy mode)"""
+        if self.mode == 'parallel':
+            for name in self.slots:
+                self._start(name)
+        elif self.mode == 'sequential':
+            threading.Thread(target=lambda: [self._load(name) for name in list(self.slots)],
+                             name="model-loader", daemon=True).start()
+
+    def _claim(self, name):
+        """True if the caller should load `name` (it was still pending)"""
+        slot = self.slots[name]
+        with self.lock:
+            if slot.state != 'pending':
+                return False
+            slot.state = 'loading'
+            return True
+
+    def _start(self, name):
+        if self._claim(name):
+            threading.Thread(target=self._run, args=(name,), name=f"load-{name}", daemon=True).start()
+
+    def _load(self, name):
+        if self._claim(name):
+            self._run(name)
+
+    def _run(self, name):
+        slot = self.slots[name]
+        print(f"Loading model '{name}'...")
+        start = time.perf_counter()
+        try:
+            slot.value = slot.loader()
+            slot.state = 'ready'
+            print(f"Model '{name}' ready in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            slot.error = str(e)
+            slot.state = 'failed'
+            print(f"Failed to load model '{name}': {e}")
+        slot.load_seconds = time.perf_counter() - start
+        slot.done.set()
+
+    def get(self, name, timeout=None):
+        """The loaded model, waiting up to `timeout` seconds (None waits forever); starts a lazy load"""
+        slot = self.slots[name]
+        if slot.state == 'pending':
+            self._start(name)
+        slot.done.wait(timeout)
+        if slot.state == 'ready':
+            return slot.value
+        if slot.state == 'failed':
+            raise ModelNotReady(f"Model '{name}' failed to load: {slot.error}")
+        raise ModelNotReady(f"Model '{name}' is still loading")
+
+    def is_ready(self, name):
+        """Whether `name` has loaded, without waiting; starts a lazy load"""
+        slot = self.slots[name]
+        if slot.state == 'pending' and self.mode == 'lazy':
+            self._start(name)
+        return slot.state == 'ready'
+
+    def all_ready(self):
+        """Whether every model has loaded, without waiting; starts the lazy loads of the pending ones"""
+        return all([self.is_ready(name) for name in self.slots])
+
+    def status(self):
+        return {
+            name: {
+                'state': slot.state,
+                'load_seconds': slot.load_seconds,
+                'error': slot.error
+            }
+            for name, slot in self.slots.items()
+        }
@@ -21,6 +21,7 @@ import shutil
 import subprocess
 import glob
 from datetime import datetime
+from onnx_models import OnnxModel
 
 # Load environment variables from .env file if it exists
 load_dotenv()
@@ -32,6 +33,9 @@ logger = logging.getLogger(__name__)
 # Environment variables with defaults
 MODEL_PATH = os.getenv('MODEL_PATH', 'best.pt')
 RESNET_PATH = os.getenv('RESNET_PATH', 'resnet.pth')
+# Leash classifier runtime: 'torch', or 'onnx-int8' for the quantized CPU model built by quantize_models.py
+LEASH_RUNTIME = os.getenv('LEASH_RUNTIME', 'torch')
+LEASH_ONNX_PATH = os.getenv('LEASH_ONNX_PATH', os.path.join('venv', 'onnx', 'leash_resnet50.int8.onnx'))
 API_ENDPOINT = os.getenv('API_ENDPOINT', 'http://127.0.0.1:8000/api/pin')
 API_TOKEN = os.getenv('API_TOKEN', 'StraySafeTeam3')
 # Updated RTSP URL format
@@ -498,19 +502,23 @@ def load_models():
     
     # Load the ResNet model for leash classification
     logger.info("Loading classification model...")
-    resnet_model = models.resnet50(weights=None)
-    resnet_model.fc = nn.Linear(in_features=2048, out_features=2)
-    
-    # Load state dict with weights_only=True for security
-    resnet_model.load_state_dict(
-        torch.load(
-            RESNET_PATH,
-            map_location=torch.device(device),
-            weights_only=True
+    if LEASH_RUNTIME == 'onnx-int8':
+        resnet_model = OnnxModel(LEASH_ONNX_PATH)
+        logger.info(f"Using INT8 leash classifier {LEASH_ONNX_PATH}")
+    else:
+        resnet_model = models.resnet50(weights=None)
+        resnet_model.fc = nn.Linear(in_features=2048, out_features=2)
+
+        # Load state dict with weights_only=True for security
+        resnet_model.load_state_dict(
+            torch.load(
+                RESNET_PATH,
+                map_location=torch.device(device),
+                weights_only=True
+            )
         )
-    )
-    resnet_model.to(device)
-    resnet_model.eval()
+        resnet_model.to(device)
+        resnet_model.eval()
     
     # Image transformation pipeline
     resnet_transform = transforms.Compose([
@@ -528,8 +536,13 @@ def encode_image_to_base64(image):
 
 def classify_leash(cropped_image):
     image_pil = Image.fromarray(cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB))
-    image_tensor = resnet_transform(image_pil).unsqueeze(0).to(device)
+    image_tensor = resnet_transform(image_pil).unsqueeze(0)
+
+    if LEASH_RUNTIME == 'onnx-int8':
+        outputs = resnet_model.predict(image_tensor.numpy())
+        return class_names[int(np.argmax(outputs[0]))]
 
+    image_tensor = image_tensor.to(device)
     with torch.no_grad():
         outputs = resnet_model(image_tensor)
         _, predicted_class = torch.max(outputs, 1)
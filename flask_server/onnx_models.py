@@ -0,0 +1,145 @@
+"""
+ONNX Runtime inference for the Keras models on CPU-only machines.
+
+The stray classifier (model.h5) and the embedding backbones are exported
+once to ONNX with tf2onnx and then served by an ONNX Runtime session with
+all graph optimizations enabled. OnnxModel exposes the part of the Keras
+Model interface the server uses (predict and output_shape), so it is a
+drop-in replacement wherever a Keras model was called. Once the .onnx files
+exist, loading them needs neither TensorFlow nor Keras.
+
+Check that an export still agrees with the Keras model with
+check_onnx_parity.py.
+
+quantize_onnx_model() makes a post-training static INT8 version of an
+export (<name>.int8.onnx), calibrated on real crops; quantize_models.py
+builds them for every model and reports the accuracy change.
+"""
+import os
+
+import numpy as np
+
+
+def cpu_budget():
+    """Number of cores this process may run on (honours taskset and cpuset limits)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def export_keras_model(model, path, opset=13):
+    """Convert a Keras model to ONNX at `path` with a dynamic batch axis"""
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input')]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=tmp_path)
+    os.replace(tmp_path, path)
+
+
+class OnnxModel:
+    """ONNX Runtime CPU session that predicts like a Keras model"""
+
+    def __init__(self, path, threads=0):
+        """
+        Args:
+            path: .onnx file
+            threads: intra-op threads, 0 uses cpu_budget()
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads or cpu_budget()
+        options.inter_op_num_threads = 1
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_shape = tuple(d if isinstance(d, int) else None for d in self.session.get_outputs()[0].shape)
+
+    def predict(self, batch, verbose=0):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+def quantized_path(onnx_path):
+    return f"{os.path.splitext(onnx_path)[0]}.int8.onnx"
+
+
+def is_stale(path, source_path):
+    """True if `path` is missing or older than `source_path` (when given)"""
+    return not os.path.exists(path) or (
+        source_path is not None and os.path.getmtime(source_path) > os.path.getmtime(path))
+
+
+def load_onnx_model(onnx_path, keras_loader, threads=0, source_path=None, int8=False):
+    """
+    OnnxModel for `onnx_path`, exporting keras_loader() to it first when the
+    file is missing or older than `source_path` (the Keras file it comes from).
+
+    With int8=True the quantized model next to it is loaded instead; if it is
+    missing or older than the float export, the float model is used and a
+    warning printed (run quantize_models.py to build it).
+    """
+    if is_stale(onnx_path, source_path):
+        print(f"Exporting {source_path or 'Keras model'} to {onnx_path}")
+        export_keras_model(keras_loader(), onnx_path)
+    if int8:
+        if not is_stale(quantized_path(onnx_path), onnx_path):
+            return OnnxModel(quantized_path(onnx_path), threads)
+        print(f"Warning: no up-to-date {quantized_path(onnx_path)}, using the float model (run quantize_models.py)")
+    return OnnxModel(onnx_path, threads)
+
+
+def quantize_onnx_model(onnx_path, calibration_batches, output_path=None, per_channel=True, method='minmax'):
+    """
+    Post-training static INT8 quantization of an ONNX model.
+
+    Weights are quantized to signed INT8 (per output channel) and activations
+    to unsigned INT8 in QDQ format, with activation ranges calibrated by
+    running the float model on `calibration_batches`.
+
+    Args:
+        onnx_path: float model
+        calibration_batches: iterable of preprocessed input batches
+        output_path: defaults to quantized_path(onnx_path)
+        method: activation range calibration, "minmax", "percentile" or "entropy"
+
+    Returns the path of the quantized model.
+    """
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    methods = {'minmax': CalibrationMethod.MinMax, 'percentile': CalibrationMethod.Percentile,
+               'entropy': CalibrationMethod.Entropy}
+    if method not in methods:
+        raise ValueError(f"Unknown calibration method '{method}', expected one of: {', '.join(methods)}")
+    output_path = output_path or quantized_path(onnx_path)
+    input_name = OnnxModel(onnx_path, threads=1).input_name
+
+    class BatchReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(calibration_batches)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {input_name: np.asarray(batch, dtype=np.float32)}
+
+    # Shape inference and graph cleanup first, as recommended for quantize_static
+    prepared_path = f"{output_path}.prep-{os.getpid()}"
+    tmp_path = f"{output_path}.tmp-{os.getpid()}"
+    try:
+        quant_pre_process(onnx_path, prepared_path)
+        quantize_static(prepared_path, tmp_path, BatchReader(), quant_format=QuantFormat.QDQ,
+                        per_channel=per_channel, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=methods[method])
+        os.replace(tmp_path, output_path)
+    finally:
+        for path in (prepared_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return output_path
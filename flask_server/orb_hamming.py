@@ -0,0 +1,283 @@
+"""
+Bulk ORB descriptor matching with NumPy XOR + popcount.
+
+All owner descriptors are packed into one contiguous (M, 32) uint8 array with
+per-pet offsets. A query's descriptors are scored against each requested pet
+as uint64 words with np.bitwise_count, in preallocated per-pet blocks,
+reproducing what
+cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match does pet by pet:
+a pair (i, j) is kept when owner descriptor j is query descriptor i's
+nearest neighbour within that pet and i is j's nearest query descriptor.
+"""
+import numpy as np
+
+DESCRIPTOR_BYTES = 32  # ORB descriptors are 256 bits
+
+# Upper bound on query_rows * owner_descriptors scored per pass (bounds peak memory)
+CHUNK_ELEMENTS = 1 << 18
+WORDS = DESCRIPTOR_BYTES // 8
+
+if hasattr(np, 'bitwise_count'):
+    def _add_popcount(words, dist, counts):
+        """dist += popcount(words), elementwise, through the preallocated `counts` buffer"""
+        np.bitwise_count(words, out=counts)
+        np.add(dist, counts, out=dist)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _add_popcount(words, dist, counts):
+        dist += _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1, dtype=np.uint16)
+
+
+def _as_words(descriptors):
+    return np.ascontiguousarray(descriptors, dtype=np.uint8).view(np.uint64)
+
+
+class PackedDescriptors:
+    """ORB descriptors of every pet in one contiguous uint8 array with per-pet offsets"""
+
+    def __init__(self, descriptor_sets):
+        """
+        Args:
+            descriptor_sets: list of (n_i, 32) uint8 arrays (or None), one per pet
+        """
+        counts = [len(d) if d is not None else 0 for d in descriptor_sets]
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(counts)
+        present = [d for d in descriptor_sets if d is not None and len(d)]
+        self.descriptors = np.ascontiguousarray(np.vstack(present), dtype=np.uint8) if present \
+            else np.zeros((0, DESCRIPTOR_BYTES), dtype=np.uint8)
+
+    @classmethod
+    def from_arrays(cls, descriptors, offsets):
+        """Wrap already packed descriptors and offsets (e.g. memory-mapped) without copying them"""
+        packed = cls([])
+        packed.descriptors = descriptors
+        packed.offsets = offsets
+        return packed
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def count(self, pet):
+        return int(self.offsets[pet + 1] - self.offsets[pet])
+
+    def get(self, pet):
+        return self.descriptors[self.offsets[pet]:self.offsets[pet + 1]]
+
+    def gather(self, pets):
+        """Descriptors of the given pets concatenated, with segment offsets into the result"""
+        pets = np.asarray(pets, dtype=np.int64)
+        counts = self.offsets[pets + 1] - self.offsets[pets]
+        seg_offsets = np.zeros(len(pets) + 1, dtype=np.int64)
+        seg_offsets[1:] = np.cumsum(counts)
+        if len(pets) == len(self) and np.array_equal(pets, np.arange(len(self))):
+            return self.descriptors, seg_offsets  # The whole registry is already contiguous
+        if seg_offsets[-1] == 0:
+            return np.zeros((0, DESCRIPTOR_BYTES), dtype=np.uint8), seg_offsets
+        return np.vstack([self.get(p) for p in pets]), seg_offsets
+
+
+def cross_check_match(query_descriptors, owner_descriptors, seg_offsets):
+    """
+    Mutual-nearest-neighbour Hamming matching of one query against many pets at once.
+
+    Args:
+        query_descriptors: (q, 32) uint8 descriptors of the query image
+        owner_descriptors: (M, 32) uint8 descriptors of all pets, concatenated
+        seg_offsets: (P + 1,) offsets of each pet's descriptors in owner_descriptors
+
+    Returns (pet_of_match, distance) arrays, one element per cross-checked match,
+    where pet_of_match indexes the segments in seg_offsets.
+    """
+    num_owner = len(owner_descriptors)
+    if query_descriptors is None or len(query_descriptors) == 0 or num_owner == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16)
+
+    # Word-major layouts, so every XOR pass broadcasts one 64-bit word of the query against one of the pet
+    query_words = np.ascontiguousarray(_as_words(query_descriptors).T)
+    owner_words = _as_words(owner_descriptors)
+    num_query = len(query_descriptors)
+    seg_lengths = np.diff(seg_offsets)
+    longest = int(seg_lengths.max())
+    chunk = max(1, min(num_query, CHUNK_ELEMENTS // longest))
+
+    # Scratch buffers reused by every pet and query chunk, no (q, M, words) temporaries
+    xor = np.empty(chunk * longest, dtype=np.uint64)
+    counts = np.empty(chunk * longest, dtype=np.uint8)
+    dist = np.empty(chunk * longest, dtype=np.uint16)
+    row_arg = np.empty(num_query, dtype=np.int64)
+
+    pets, distances = [], []
+    for pet in np.flatnonzero(seg_lengths):
+        start, length = int(seg_offsets[pet]), int(seg_lengths[pet])
+        pet_words = np.ascontiguousarray(owner_words[start:start + length].T)
+        # Best query row for each of the pet's descriptors (first minimum, like BFMatcher)
+        col_min = np.full(length, np.iinfo(np.uint16).max, dtype=np.uint16)
+        col_arg = np.zeros(length, dtype=np.int64)
+        columns = np.arange(length)
+
+        for q_start in range(0, num_query, chunk):
+            rows = min(chunk, num_query - q_start)
+            block_xor = xor[:rows * length].reshape(rows, length)
+            block_counts = counts[:rows * length].reshape(rows, length)
+            block = dist[:rows * length].reshape(rows, length)
+            block.fill(0)
+            for w in range(WORDS):
+                np.bitwise_xor(query_words[w, q_start:q_start + rows, None], pet_words[w][None, :], out=block_xor)
+                _add_popcount(block_xor, block, block_counts)
+
+            # Best descriptor of this pet for each query row
+            row_arg[q_start:q_start + rows] = np.argmin(block, axis=1)
+            chunk_arg = np.argmin(block, axis=0)
+            chunk_min = block[chunk_arg, columns]
+            better = chunk_min < col_min
+            col_min[better] = chunk_min[better]
+            col_arg[better] = chunk_arg[better] + q_start
+
+        mutual = row_arg[col_arg] == columns
+        pets.append(np.full(int(mutual.sum()), pet, dtype=np.int64))
+        distances.append(col_min[mutual])
+
+    if not pets:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint16)
+    return np.concatenate(pets), np.concatenate(distances)
+
+
+def summarize_matches(pet_of_match, distances, num_pets, top_n=30, good_threshold=50):
+    """
+    Per-pet equivalent of sorting a pet's matches by distance, keeping the first
+    `top_n` and counting those below `good_threshold`.
+
+    Returns (good_counts, avg_good_distance) arrays of length num_pets.
+    """
+    order = np.lexsort((distances, pet_of_match))
+    pets = pet_of_match[order]
+    dists = distances[order].astype(np.float64)
+
+    group_start = np.searchsorted(pets, pets, side='left')
+    rank = np.arange(len(pets)) - group_start
+    good = (rank < top_n) & (dists < good_threshold)
+
+    good_counts = np.bincount(pets[good], minlength=num_pets)
+    good_sums = np.bincount(pets[good], weights=dists[good], minlength=num_pets)
+    avg = np.divide(good_sums, good_counts, out=np.zeros(num_pets), where=good_counts > 0)
+    return good_counts, avg
+
+
+class HammingLSH:
+    """
+    Multi-table bit-sampling LSH over packed ORB descriptors.
+
+    Each table hashes a descriptor by `key_bits` randomly chosen bits out of
+    256, so descriptors within a small Hamming distance land in the same
+    bucket with high probability. A query descriptor votes for every pet that
+    owns a descriptor in its bucket, and only the top-voted pets are passed on
+    to full cross-check verification. The cost of a lookup depends on bucket
+    sizes rather than on the number of registered pets.
+    """
+
+    def __init__(self, packed, n_tables=8, key_bits=16, max_bucket=256, seed=0):
+        """
+        Args:
+            packed: PackedDescriptors of the registry
+            n_tables: number of hash tables (more tables, higher recall)
+            key_bits: bits sampled per table (more bits, smaller and more precise buckets)
+            max_bucket: buckets holding more descriptors than this are ignored as uninformative
+            seed: random seed for the bit selection
+        """
+        rng = np.random.default_rng(seed)
+        self.offsets = packed.offsets
+        self.max_bucket = max_bucket
+        self.bit_sets = [rng.choice(DESCRIPTOR_BYTES * 8, key_bits, replace=False) for _ in range(n_tables)]
+        # Descriptor positions [start, end) of the pets this index answers for, see subset()
+        self.descriptor_range = None
+
+        self.tables = []
+        for bit_set in self.bit_sets:
+            keys = self._keys(packed.descriptors, bit_set)
+            order = np.argsort(keys, kind='stable')
+            self.tables.append((keys[order], order))
+
+    @classmethod
+    def from_arrays(cls, offsets, bit_sets, keys, positions, max_bucket=256):
+        """Wrap tables saved from arrays() (e.g. memory-mapped) without copying them"""
+        lsh = cls.__new__(cls)
+        lsh.offsets = offsets
+        lsh.max_bucket = max_bucket
+        lsh.bit_sets = list(bit_sets)
+        lsh.descriptor_range = None
+        lsh.tables = list(zip(keys, positions))
+        return lsh
+
+    def arrays(self):
+        """(bit_sets, keys, positions) as (n_tables, key_bits), (n_tables, M) and (n_tables, M) arrays"""
+        return (np.array(self.bit_sets, dtype=np.int64),
+                np.array([keys for keys, _ in self.tables], dtype=np.uint64).reshape(len(self.tables), -1),
+                np.array([positions for _, positions in self.tables], dtype=np.int64).reshape(len(self.tables), -1))
+
+    def subset(self, start, end):
+        """
+        Index over pets [start, end) only, sharing this index's tables.
+
+        Bucket sizes (and so max_bucket) still count the descriptors of every pet.
+        """
+        lsh = HammingLSH.from_arrays(self.offsets[start:end + 1] - self.offsets[start], self.bit_sets,
+                                     [keys for keys, _ in self.tables], [positions for _, positions in self.tables],
+                                     self.max_bucket)
+        base = self.descriptor_range[0] if self.descriptor_range else 0
+        lsh.descriptor_range = (base + int(self.offsets[start]), base + int(self.offsets[end]))
+        return lsh
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _keys(self, descriptors, bit_set):
+        """Concatenate the sampled bits of each descriptor into an integer bucket key"""
+        keys = np.zeros(len(descriptors), dtype=np.uint64)
+        for i, bit in enumerate(bit_set):
+            byte, shift = divmod(int(bit), 8)
+            keys |= ((descriptors[:, byte] >> (7 - shift)) & 1).astype(np.uint64) << np.uint64(i)
+        return keys
+
+    def votes(self, query_descriptors):
+        """Number of bucket collisions between the query and each pet's descriptors"""
+        votes = np.zeros(len(self), dtype=np.int64)
+        if query_descriptors is None or len(query_descriptors) == 0 or len(self.tables[0][0]) == 0:
+            return votes
+
+        query_descriptors = np.ascontiguousarray(query_descriptors, dtype=np.uint8)
+        for bit_set, (sorted_keys, positions) in zip(self.bit_sets, self.tables):
+            keys = self._keys(query_descriptors, bit_set)
+            left = np.searchsorted(sorted_keys, keys, side='left')
+            right = np.searchsorted(sorted_keys, keys, side='right')
+            lengths = right - left
+            usable = (lengths > 0) & (lengths <= self.max_bucket)
+            left, lengths = left[usable], lengths[usable]
+            if not len(lengths):
+                continue
+
+            # Expand every [left, right) bucket range into the descriptor positions it holds
+            total = int(lengths.sum())
+            starts = np.repeat(left - np.cumsum(lengths) + lengths, lengths)
+            hits = positions[starts + np.arange(total)]
+            if self.descriptor_range is not None:
+                low, high = self.descriptor_range
+                hits = hits[(hits >= low) & (hits < high)] - low
+            pets = np.searchsorted(self.offsets, hits, side='right') - 1
+            votes += np.bincount(pets, minlength=len(self))
+        return votes
+
+    def candidates(self, query_descriptors, top_n, among=None):
+        """
+        Indices of the top_n most-voted pets (pets without votes are never returned).
+
+        Args:
+            among: optional array of pet indices to restrict the candidates to
+        """
+        votes = self.votes(query_descriptors)
+        pool = np.arange(len(self)) if among is None else np.asarray(among, dtype=np.int64)
+        pool = pool[votes[pool] > 0]
+        if len(pool) > top_n:
+            pool = pool[np.argpartition(-votes[pool], top_n - 1)[:top_n]]
+        return pool[np.argsort(-votes[pool], kind='stable')]
@@ -0,0 +1,557 @@
+"""
+In-memory feature index for the registered pet images in DATABASE_PATH.
+
+Every owner image is read and described once when the index is built
+(colour histogram, ORB keypoints/descriptors and CNN embedding), so matching
+a detected animal only has to compute features for the query crop.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+import cv2
+import numpy as np
+
+from orb_hamming import PackedDescriptors
+
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg")
+
+# Hue/saturation histogram settings used for coat colour comparison
+# hue varies from 0 to 179, saturation from 0 to 255
+H_BINS = 50
+S_BINS = 60
+HIST_RANGES = [0, 180, 0, 256]
+
+# Images are downscaled to this size before ORB so both sides have a similar scale
+ORB_MAX_DIM = 512
+
+# Species the owner index can be partitioned by (the detector's dog/cat classes)
+SPECIES = ('dog', 'cat')
+
+
+def list_registry_images(database_path):
+    """Return the image filenames in the registry directory (sorted for stable ordering)"""
+    if not os.path.exists(database_path):
+        return []
+    return sorted(f for f in os.listdir(database_path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def compute_color_histogram(img):
+    """Normalized H/S histogram of a BGR image"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [H_BINS, S_BINS], HIST_RANGES)
+    cv2.normalize(hist, hist, 0, 1, cv2.NORM_MINMAX)
+    return hist
+
+
+def compute_orb_features(img, orb):
+    """Detect ORB keypoints/descriptors on a grayscale copy capped at ORB_MAX_DIM"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+    scale = ORB_MAX_DIM / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(gray.shape[1] * scale), int(gray.shape[0] * scale)))
+    return orb.detectAndCompute(gray, None)
+
+
+def compute_image_features(img, orb, embed_fn=None):
+    """
+    Compute every feature the matcher needs for one image.
+
+    Keypoints are stored as an (N, 2) array of coordinates instead of
+    cv2.KeyPoint objects so the entry can be pickled or written to disk.
+    """
+    keypoints, descriptors = compute_orb_features(img, orb)
+    return {
+        'histogram': compute_color_histogram(img),
+        'keypoints': cv2.KeyPoint_convert(keypoints) if keypoints else np.zeros((0, 2), np.float32),
+        'descriptors': descriptors,
+        'embedding': embed_fn(img) if embed_fn is not None else None
+    }
+
+
+def normalize_rows(vectors):
+    """L2-normalize each row as float32; all-zero rows are left as zeros"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def correlation_rows(histograms):
+    """
+    Center and L2-normalize flattened histograms so a dot product between two
+    rows equals cv2.compareHist(..., cv2.HISTCMP_CORREL).
+
+    Histograms may be (H_BINS, S_BINS) or already flat, e.g. rows of a mapped index file.
+    """
+    flat = np.array([np.asarray(h, dtype=np.float32).ravel() for h in histograms], dtype=np.float32) \
+        if len(histograms) else np.zeros((0, H_BINS * S_BINS), dtype=np.float32)
+    return normalize_rows(flat - flat.mean(axis=1, keepdims=True))
+
+
+class EmbeddingMatrix:
+    """
+    Owner embeddings stored as one contiguous, pre-normalized float32 matrix
+    with a parallel array of filenames.
+
+    Cosine similarity against the whole registry is a single matrix-vector
+    product, and argpartition picks the top-K without sorting every score.
+    """
+
+    def __init__(self, filenames=(), embeddings=None):
+        self.filenames = np.array(list(filenames), dtype=object)
+        if embeddings is None or len(self.filenames) == 0:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(np.vstack(embeddings)))
+
+    @classmethod
+    def from_normalized(cls, filenames, matrix):
+        """Wrap rows that are already L2-normalized (e.g. memory-mapped) without copying them"""
+        embeddings = cls()
+        embeddings.filenames = np.array(list(filenames), dtype=object)
+        embeddings.matrix = matrix
+        return embeddings
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def keys(self):
+        return list(self.filenames)
+
+    def _top_k(self, sims, k):
+        # argpartition finds the k best in O(N); only those k are then sorted
+        k = min(k, sims.shape[-1])
+        if k < sims.shape[-1]:
+            top = np.argpartition(-sims, k - 1, axis=-1)[..., :k]
+        else:
+            top = np.broadcast_to(np.arange(sims.shape[-1]), sims.shape[:-1] + (k,))
+        order = np.argsort(-np.take_along_axis(sims, top, axis=-1), axis=-1)
+        return np.take_along_axis(top, order, axis=-1)
+
+    def search(self, query, k=5):
+        """Return the k most similar owners as [(filename, cosine_similarity), ...], best first"""
+        return self.search_batch(np.asarray(query)[None, :], k)[0]
+
+    def search_batch(self, queries, k=5):
+        """
+        Search many query embeddings at once.
+
+        Args:
+            queries: array of shape (num_queries, dim)
+            k: number of results per query
+
+        Returns a list with one [(filename, cosine_similarity), ...] list per query
+        """
+        queries = np.asarray(queries)
+        if len(self) == 0 or k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        sims = normalize_rows(queries) @ self.matrix.T
+        top = self._top_k(sims, k)
+        return [
+            [(self.filenames[i], float(row_sims[i])) for i in row_top]
+            for row_top, row_sims in zip(top, sims)
+        ]
+
+
+class OwnerIndex:
+    """
+    Snapshot of the registry features keyed by image filename.
+
+    A built index is never modified in place; callers build a new one and
+    swap the reference, so a match that is already running keeps a
+    consistent view of the registry.
+    """
+
+    def __init__(self, database_path, entries=None, histograms=None, descriptors=None, embeddings=None):
+        """
+        Args:
+            database_path: registry directory the entries were read from
+            entries: dict of filename -> features (see compute_image_features)
+            histograms, descriptors, embeddings: the packed arrays, when they already
+                exist (e.g. memory-mapped from an index file); built from entries otherwise
+        """
+        self.database_path = database_path
+        self.entries = entries if entries is not None else {}
+        self.names = list(self.entries)
+
+        # Colour histograms of every entry (in `names` order) for one-shot correlation
+        if histograms is not None:
+            self.histograms = histograms
+        else:
+            self.histograms = correlation_rows([self.entries[f]['histogram'] for f in self.names]) \
+                if self.names else np.zeros((0, H_BINS * S_BINS), dtype=np.float32)
+        # ORB descriptors of every entry packed into one array, also in `names` order
+        self.descriptors = descriptors if descriptors is not None \
+            else PackedDescriptors([self.entries[f]['descriptors'] for f in self.names])
+
+        if embeddings is not None:
+            self.embeddings = embeddings
+        else:
+            with_embedding = [(fname, entry['embedding']) for fname, entry in self.entries.items()
+                              if entry.get('embedding') is not None]
+            self.embeddings = EmbeddingMatrix(
+                [fname for fname, _ in with_embedding],
+                [embedding for _, embedding in with_embedding]
+            )
+        # Exact search by default; may be replaced by an ANN index with the same interface
+        self.embedding_search = self.embeddings
+        # Optional orb_hamming.HammingLSH over `descriptors`, attached by the server when enabled
+        self.lsh = None
+        # Directory of the match_pool snapshot of this index, written by the server when the pool is enabled
+        self.pool_snapshot = None
+        # Unreadable registry files and the (size, mtime_ns) they were seen with
+        self.failed = {}
+        # Per-species sub-indexes ({'dog': OwnerIndex, 'cat': OwnerIndex}), attached by the server
+        self.partitions = {}
+        # Optional pet_gallery.PetGallery grouping the entries by pet, attached by the server
+        self.gallery = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, fname):
+        return fname in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def items(self):
+        return self.entries.items()
+
+    def filenames(self):
+        return list(self.names)
+
+    def color_similarities(self, histogram):
+        """HISTCMP_CORREL of a query histogram against every entry, aligned with `names`"""
+        return self.histograms @ correlation_rows([histogram])[0]
+
+    def path(self, fname):
+        return os.path.join(self.database_path, fname)
+
+    def species_counts(self):
+        counts = {}
+        for entry in self.entries.values():
+            species = entry.get('species') or 'unknown'
+            counts[species] = counts.get(species, 0) + 1
+        return counts
+
+    def partition(self, species):
+        """
+        Sub-index of the pets of one species.
+
+        Entries without a species label are kept in every partition so they stay matchable.
+        """
+        entries = {fname: entry for fname, entry in self.entries.items()
+                   if entry.get('species') in (species, None)}
+        return OwnerIndex(self.database_path, entries)
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of registry embeddings so a restart doesn't re-embed every image.
+
+    Stored as an .npy matrix (opened with mmap) plus a JSON manifest mapping each
+    registry filename to its row, file size, mtime and SHA-1. An entry is reused
+    when size and mtime are unchanged, or when they changed but the content hash
+    is the same. Entries for files no longer in the registry are dropped on save.
+    """
+
+    MANIFEST_VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self.entries = {}
+        self.matrix = None
+        self.matrix_file = None
+        self._hashes = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') != self.MANIFEST_VERSION:
+                print(f"Ignoring embedding cache in {self.cache_dir}: unsupported version")
+                return
+            self.matrix = np.load(os.path.join(self.cache_dir, manifest['matrix_file']), mmap_mode='r')
+            self.matrix_file = manifest['matrix_file']
+            self.entries = manifest['entries']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Ignoring unreadable embedding cache in {self.cache_dir}: {e}")
+            self.entries = {}
+            self.matrix = None
+
+    def _stat_matches(self, entry, stat):
+        return entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns
+
+    def _hash(self, path, stat):
+        # Remember hashes per (path, size, mtime) so lookup and save hash a file at most once
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._hashes:
+            self._hashes[key] = file_sha1(path)
+        return self._hashes[key]
+
+    def lookup(self, fname, path):
+        """Return the cached embedding for a registry image, or None if missing or stale"""
+        entry = self.entries.get(fname)
+        if entry is None or self.matrix is None:
+            return None
+
+        stat = os.stat(path)
+        if self._stat_matches(entry, stat) or self._hash(path, stat) == entry['sha1']:
+            return self.matrix[entry['row']]
+        return None
+
+    def save(self, records):
+        """
+        Persist the embeddings of the current registry, replacing the previous cache.
+
+        Args:
+            records: dict of filename -> (path, embedding)
+        """
+        records = {fname: rec for fname, rec in records.items() if rec[1] is not None}
+        new_entries = {}
+        for row, (fname, (path, _)) in enumerate(records.items()):
+            stat = os.stat(path)
+            old = self.entries.get(fname)
+            sha1 = old['sha1'] if old and self._stat_matches(old, stat) else self._hash(path, stat)
+            new_entries[fname] = {'row': row, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1}
+
+        if new_entries == self.entries and self.matrix is not None:
+            return False
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write the matrix under a new name and switch the manifest over atomically,
+        # so a crash mid-save never pairs a manifest with the wrong matrix
+        matrix_file = f"embeddings-{uuid.uuid4().hex[:12]}.npy"
+        matrix = np.vstack([np.asarray(emb, dtype=np.float32) for _, emb in records.values()]) \
+            if records else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(self.cache_dir, matrix_file), matrix)
+
+        tmp_manifest = self.manifest_path + '.tmp'
+        with open(tmp_manifest, 'w') as f:
+            json.dump({'version': self.MANIFEST_VERSION, 'matrix_file': matrix_file, 'entries': new_entries}, f)
+        os.replace(tmp_manifest, self.manifest_path)
+
+        old_matrix_file = self.matrix_file
+        self.load()
+        if old_matrix_file and old_matrix_file != matrix_file:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_matrix_file))
+            except OSError:
+                pass
+        return True
+
+
+class SpeciesLabels:
+    """
+    Species ('dog' or 'cat') of each registry image.
+
+    Labels come from a JSON metadata file ({filename: species}) that the web app
+    or an admin can write. Images without a label are classified once with
+    `detect_fn` and the result is written back to the file, so the detector
+    only ever runs on new images. Edits to the file are picked up by the next
+    build or update.
+    """
+
+    def __init__(self, path, detect_fn=None):
+        self.path = path
+        self.detect_fn = detect_fn
+        self.labels = {}
+        self.saved = {}
+        self.mtime_ns = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns == self.mtime_ns:
+            return
+        try:
+            with open(self.path) as f:
+                labels = {fname: species for fname, species in json.load(f).items() if species in SPECIES}
+        except Exception as e:
+            print(f"Ignoring unreadable species metadata {self.path}: {e}")
+            return
+        # Keep detector labels that haven't been written yet
+        self.labels = {**{f: s for f, s in self.labels.items() if f not in self.saved}, **labels}
+        self.saved = labels
+        self.mtime_ns = mtime_ns
+
+    def label(self, fname, img):
+        species = self.labels.get(fname)
+        if species is None and self.detect_fn is not None:
+            species = self.detect_fn(img)
+            if species in SPECIES:
+                self.labels[fname] = species
+        return species
+
+    def save(self, fnames):
+        """Write the labels of the given registry files back to the metadata file, if anything changed"""
+        self.labels = {fname: species for fname, species in self.labels.items() if fname in fnames}
+        if self.labels == self.saved:
+            return
+        try:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.labels, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self.saved = dict(self.labels)
+            self.mtime_ns = os.stat(self.path).st_mtime_ns
+        except Exception as e:
+            print(f"Failed to save species metadata {self.path}: {e}")
+
+
+def scan_registry(database_path):
+    """Return {filename: (size, mtime_ns)} for every image in the registry directory"""
+    stats = {}
+    for fname in list_registry_images(database_path):
+        try:
+            stat = os.stat(os.path.join(database_path, fname))
+        except OSError:
+            continue  # Removed between listdir and stat
+        stats[fname] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+def _load_entry(database_path, fname, orb, embed_fn, embedding_cache, species_labels=None):
+    """Read one registry image and compute its features; returns (features, reused_cached_embedding)"""
+    path = os.path.join(database_path, fname)
+    stat = os.stat(path)
+    img = cv2.imread(path)
+
+    if img is None:
+        print(f"Failed to read image: {path}")
+        return None, False
+
+    features = compute_image_features(img, orb)
+    embedding = embedding_cache.lookup(fname, path) if embedding_cache is not None else None
+    reused = embedding is not None
+    if not reused and embed_fn is not None:
+        embedding = embed_fn(img)
+    features['embedding'] = embedding
+    features['species'] = species_labels.label(fname, img) if species_labels is not None else None
+    features['stat'] = (stat.st_size, stat.st_mtime_ns)
+    return features, reused
+
+
+def _save_embedding_cache(embedding_cache, database_path, entries):
+    try:
+        embedding_cache.save({fname: (os.path.join(database_path, fname), entry['embedding'])
+                              for fname, entry in entries.items()})
+    except Exception as e:
+        print(f"Failed to save embedding cache: {e}")
+
+
+def build_owner_index(database_path, orb, embed_fn=None, embedding_cache=None, species_labels=None):
+    """
+    Read every registry image once and return an OwnerIndex with its features.
+
+    With an EmbeddingCache, unchanged images reuse their stored embedding and
+    only new or modified images are passed to embed_fn. The cache is then
+    rewritten to match the registry, dropping entries for removed images.
+    With SpeciesLabels, every entry also records its species.
+    """
+    entries = {}
+    reused = 0
+    if species_labels is not None:
+        species_labels.reload_if_changed()
+    for fname in list_registry_images(database_path):
+        try:
+            features, from_cache = _load_entry(database_path, fname, orb, embed_fn, embedding_cache, species_labels)
+        except Exception as e:
+            print(f"Error computing features for {os.path.join(database_path, fname)}: {e}")
+            continue
+        if features is not None:
+            entries[fname] = features
+            reused += from_cache
+
+    if embedding_cache is not None:
+        print(f"Embedding cache: reused {reused}, computed {len(entries) - reused}")
+        _save_embedding_cache(embedding_cache, database_path, entries)
+    if species_labels is not None:
+        species_labels.save(entries)
+
+    return OwnerIndex(database_path, entries)
+
+
+def update_owner_index(index, orb, embed_fn=None, embedding_cache=None, min_age=1.0, species_labels=None):
+    """
+    Incrementally bring an OwnerIndex in line with the registry directory.
+
+    Only images that were added or whose size/mtime changed are read and
+    described; removed images are dropped and unchanged entries are shared
+    with the old index. The old index is left untouched (copy-on-write), so
+    callers can swap the returned index in while matches keep using the old one.
+
+    Files modified less than `min_age` seconds ago are skipped until the next
+    call, so images that are still being uploaded are not read half-written.
+
+    Returns (new_index, changes) where changes has 'added', 'updated' and
+    'removed' filename lists; new_index is the old index if nothing changed.
+    """
+    stats = scan_registry(index.database_path)
+    now_ns = time.time_ns()
+    changes = {'added': [], 'updated': [], 'removed': [f for f in index.entries if f not in stats]}
+    entries = {fname: entry for fname, entry in index.entries.items() if fname in stats}
+    failed = {fname: stat for fname, stat in index.failed.items() if stats.get(fname) == stat}
+    if species_labels is not None:
+        species_labels.reload_if_changed()
+
+    for fname, stat in stats.items():
+        old = index.entries.get(fname)
+        if old is not None and old.get('stat') == stat:
+            # Unchanged image, but its species may have been relabelled in the metadata file
+            species = species_labels.labels.get(fname, old.get('species')) if species_labels is not None else old.get('species')
+            if species != old.get('species'):
+                entries[fname] = dict(old, species=species)
+                changes['updated'].append(fname)
+            continue
+        if failed.get(fname) == stat or now_ns - stat[1] < min_age * 1e9:
+            continue
+
+        try:
+            features, _ = _load_entry(index.database_path, fname, orb, embed_fn, embedding_cache, species_labels)
+        except Exception as e:
+            print(f"Error computing features for {index.path(fname)}: {e}")
+            features = None
+
+        if features is None:
+            # Don't retry an unreadable file until it changes on disk
+            failed[fname] = stat
+            if old is not None:
+                del entries[fname]
+                changes['removed'].append(fname)
+            continue
+
+        entries[fname] = features
+        changes['updated' if old is not None else 'added'].append(fname)
+
+    if not any(changes.values()):
+        index.failed = failed
+        return index, changes
+
+    if embedding_cache is not None:
+        _save_embedding_cache(embedding_cache, index.database_path, entries)
+    if species_labels is not None:
+        species_labels.save(entries)
+
+    new_index = OwnerIndex(index.database_path, entries)
+    new_index.failed = failed
+    return new_index, changes
@@ -0,0 +1,200 @@
+"""
+Single-file, memory-mapped owner index for multi-process deployments.
+
+The packed owner index arrays (colour correlation rows, ORB descriptors and
+their offsets, keypoints and normalized embeddings) are written to one
+read-only file: a small JSON header followed by the raw, 64-byte aligned
+arrays. Every process maps the file and uses NumPy views into it, so the
+registry features live once in the page cache however many workers load it.
+
+The file is replaced atomically (written next to it, then os.replace), so a
+process that still maps the previous version keeps a consistent view until
+it reloads.
+
+Rows are stored dogs first, then pets without a species label, then cats.
+Each species partition (its own pets plus the unlabelled ones) is then one
+contiguous row range and is served as a view as well.
+
+With ORB_MATCHER=lsh the HammingLSH tables are built once by the writer and
+stored in the file too, since they are several times the size of the packed
+descriptors; species partitions use subsets of the same tables.
+"""
+import json
+import os
+
+import numpy as np
+
+from orb_hamming import DESCRIPTOR_BYTES, HammingLSH, PackedDescriptors
+from owner_index import H_BINS, S_BINS, EmbeddingMatrix, OwnerIndex
+
+MAGIC = b'OWNERIDX'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+# File row order: dogs, unlabelled, cats
+SPECIES_ORDER = {'dog': 0, None: 1, 'cat': 2}
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_owner_index(index, path, lsh=None):
+    """
+    Write `index` to `path` in the memory-mappable format, replacing any previous file.
+
+    Args:
+        lsh: HammingLSH keyword arguments (n_tables, key_bits) to build and store its tables, or None
+    """
+    row_of = {fname: row for row, fname in enumerate(index.names)}
+    names = sorted(index.names, key=lambda f: SPECIES_ORDER.get(index.entries[f].get('species'), 1))
+    order = np.array([row_of[f] for f in names], dtype=np.int64)
+    entries = [index.entries[f] for f in names]
+
+    descriptors, descriptor_offsets = index.descriptors.gather(order) if len(order) \
+        else (np.zeros((0, DESCRIPTOR_BYTES), dtype=np.uint8), np.zeros(1, dtype=np.int64))
+    keypoints = [np.asarray(e['keypoints'], dtype=np.float32).reshape(-1, 2) for e in entries]
+    embedding_row = {fname: row for row, fname in enumerate(index.embeddings.filenames)}
+    has_embedding = [f in embedding_row for f in names]
+
+    arrays = {
+        'histograms': np.asarray(index.histograms[order], dtype=np.float32).reshape(len(order), H_BINS * S_BINS),
+        'descriptors': np.ascontiguousarray(descriptors, dtype=np.uint8),
+        'descriptor_offsets': descriptor_offsets.astype(np.int64),
+        'keypoints': np.vstack(keypoints) if keypoints else np.zeros((0, 2), dtype=np.float32),
+        'keypoint_offsets': np.concatenate([[0], np.cumsum([len(k) for k in keypoints])]).astype(np.int64),
+        'embeddings': np.asarray(index.embeddings.matrix[[embedding_row[f] for f in names if f in embedding_row]],
+                                 dtype=np.float32) if any(has_embedding) else np.zeros((0, 0), dtype=np.float32),
+        'embedding_offsets': np.concatenate([[0], np.cumsum(has_embedding)]).astype(np.int64),
+    }
+    if lsh is not None:
+        tables = HammingLSH(PackedDescriptors.from_arrays(arrays['descriptors'], arrays['descriptor_offsets']), **lsh)
+        arrays['lsh_bits'], arrays['lsh_keys'], arrays['lsh_positions'] = tables.arrays()
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps({
+        'version': FORMAT_VERSION,
+        'database_path': index.database_path,
+        'names': names,
+        'stats': [e.get('stat') for e in entries],
+        'species': [e.get('species') for e in entries],
+        'failed': index.failed,
+        'arrays': layout
+    }).encode()
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        data_start = _align(f.tell())
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def load_owner_index(path):
+    """Map an index file written by save_owner_index; returns a MappedOwnerIndex"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an owner index file")
+        header_len = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_len))
+        stat = os.fstat(f.fileno())
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported owner index version {header.get('version')}")
+
+    # One mapping of the whole file; every array is a view into it
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    data_start = _align(len(MAGIC) + 8 + header_len)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        start = data_start + spec['offset']
+        size = int(np.prod(spec['shape'])) * dtype.itemsize
+        arrays[name] = buffer[start:start + size].view(dtype).reshape(spec['shape'])
+
+    index = MappedOwnerIndex(header['database_path'], header['names'], header['stats'], header['species'], arrays)
+    index.failed = {fname: tuple(s) for fname, s in header['failed'].items()}
+    index.stamp = (stat.st_ino, stat.st_mtime_ns)
+    return index
+
+
+def file_stamp(path):
+    """(inode, mtime_ns) of the index file, compared against MappedOwnerIndex.stamp to detect a new version"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _view_rows(names, stats, species, arrays, start, end):
+    """
+    Entries and packed arrays for rows [start, end) of a mapped file, built from views only.
+
+    Returns (entries, arrays) where arrays holds the histograms/descriptors/embeddings
+    keyword arguments of OwnerIndex.
+    """
+    descriptor_offsets = arrays['descriptor_offsets']
+    keypoint_offsets = arrays['keypoint_offsets']
+    embedding_offsets = arrays['embedding_offsets']
+    descriptors = arrays['descriptors']
+    keypoints = arrays['keypoints']
+    embeddings = arrays['embeddings']
+
+    entries = {}
+    for row in range(start, end):
+        has_embedding = embedding_offsets[row + 1] > embedding_offsets[row]
+        entries[names[row]] = {
+            # Same (H_BINS, S_BINS) shape as a freshly computed histogram, as a view of the stored row
+            'histogram': arrays['histograms'][row].reshape(H_BINS, S_BINS),
+            'keypoints': keypoints[keypoint_offsets[row]:keypoint_offsets[row + 1]],
+            'descriptors': descriptors[descriptor_offsets[row]:descriptor_offsets[row + 1]],
+            'embedding': embeddings[embedding_offsets[row]] if has_embedding else None,
+            'stat': tuple(stats[row]) if stats[row] is not None else None,
+            'species': species[row]
+        }
+
+    base = descriptor_offsets[start]
+    embedded = [names[row] for row in range(start, end) if embedding_offsets[row + 1] > embedding_offsets[row]]
+    return entries, {
+        'histograms': arrays['histograms'][start:end],
+        'descriptors': PackedDescriptors.from_arrays(
+            descriptors[base:descriptor_offsets[end]], descriptor_offsets[start:end + 1] - base),
+        'embeddings': EmbeddingMatrix.from_normalized(
+            embedded, embeddings[embedding_offsets[start]:embedding_offsets[end]])
+    }
+
+
+class MappedOwnerIndex(OwnerIndex):
+    """OwnerIndex whose arrays and entry features are views into a memory-mapped index file"""
+
+    def __init__(self, database_path, names, stats, species, arrays):
+        entries, packed = _view_rows(names, stats, species, arrays, 0, len(names))
+        super().__init__(database_path, entries, **packed)
+        self._file_rows = (names, stats, species, arrays)
+        if 'lsh_keys' in arrays:
+            self.lsh = HammingLSH.from_arrays(arrays['descriptor_offsets'], arrays['lsh_bits'],
+                                              arrays['lsh_keys'], arrays['lsh_positions'])
+        # (inode, mtime_ns) of the file this index was loaded from, see file_stamp
+        self.stamp = None
+
+    def partition(self, species):
+        """Species partition as a view when its rows are contiguous in the file (see SPECIES_ORDER)"""
+        rows = [row for row, fname in enumerate(self.names)
+                if self.entries[fname].get('species') in (species, None)]
+        if rows and rows[-1] - rows[0] + 1 == len(rows):
+            entries, packed = _view_rows(*self._file_rows, rows[0], rows[-1] + 1)
+            index = OwnerIndex(self.database_path, entries, **packed)
+            if self.lsh is not None:
+                index.lsh = self.lsh.subset(rows[0], rows[-1] + 1)
+            return index
+        return super().partition(species)
@@ -0,0 +1,164 @@
+"""
+Per-pet grouping of registry images with prototype-first search.
+
+Owners upload several photos of the same pet. Which photos belong together
+comes from a JSON metadata file ({filename: pet_id}) written by the web app or
+an admin, like the species labels; a photo without an entry is a pet of its
+own. Images are grouped by pet ID and each pet gets:
+  - a centroid embedding and a centroid colour histogram (its prototypes)
+  - a few diverse exemplar images, picked by farthest-point sampling
+A query is first compared against one prototype per pet; only the closest
+pets are expanded to their exemplar images for the exact colour/ORB and
+embedding comparisons.
+"""
+import json
+import os
+
+import numpy as np
+
+from owner_index import EmbeddingMatrix, normalize_rows
+
+
+def one_pet_per_file(fname):
+    return fname
+
+
+class PetIds:
+    """
+    Pet ID of each registry image, from a JSON metadata file ({filename: pet_id}).
+
+    Images without an entry (or every image, when the file doesn't exist) are
+    treated as one pet each. Edits to the file are picked up by the next
+    reload_if_changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pet_ids = {}
+        self.mtime_ns = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+        except OSError:
+            self.pet_ids, self.mtime_ns = {}, None
+            return
+        if mtime_ns == self.mtime_ns:
+            return
+        try:
+            with open(self.path) as f:
+                self.pet_ids = {fname: str(pet_id) for fname, pet_id in json.load(f).items() if pet_id is not None}
+        except Exception as e:
+            print(f"Ignoring unreadable pet metadata {self.path}: {e}")
+            return
+        self.mtime_ns = mtime_ns
+
+    def __call__(self, fname):
+        return self.pet_ids.get(fname, fname)
+
+
+def diverse_exemplars(vectors, k):
+    """
+    Indices of up to k mutually dissimilar rows of `vectors` (normalized).
+
+    Starts from the row closest to the centroid and repeatedly adds the row
+    least similar to everything picked so far.
+    """
+    if len(vectors) <= k:
+        return list(range(len(vectors)))
+    centroid = vectors.mean(axis=0)
+    picked = [int(np.argmax(vectors @ centroid))]
+    closest = vectors @ vectors[picked[0]]
+    while len(picked) < k:
+        candidate = int(np.argmin(closest))
+        picked.append(candidate)
+        closest = np.maximum(closest, vectors @ vectors[candidate])
+    return picked
+
+
+class PetGallery:
+    """
+    Pets of an OwnerIndex with their prototypes and exemplar images.
+
+    Implements search/search_batch like EmbeddingMatrix, so it can stand in for
+    index.embedding_search: prototypes are searched first and the top pets
+    are expanded to their exemplar embeddings.
+    """
+
+    def __init__(self, index, max_exemplars=3, pet_id_fn=one_pet_per_file):
+        """
+        Args:
+            index: OwnerIndex to group
+            max_exemplars: exemplar images kept per pet
+            pet_id_fn: maps a registry filename to its pet ID (e.g. a PetIds); one pet per file by default
+        """
+        self.index = index
+        members = {}
+        for row, fname in enumerate(index.names):
+            members.setdefault(pet_id_fn(fname), []).append(row)
+        self.pet_ids = list(members)
+
+        self.embedding_rows = {fname: row for row, fname in enumerate(index.embeddings.filenames)}
+        self.exemplar_rows = []  # per pet, rows into index.names
+        color_prototypes = []
+        centroid_names, centroids = [], []
+        for pet_id, rows in members.items():
+            colors = index.histograms[rows]
+            embedded = [self.embedding_rows[index.names[r]] for r in rows if index.names[r] in self.embedding_rows]
+            vectors = index.embeddings.matrix[embedded] if len(embedded) == len(rows) else colors
+            self.exemplar_rows.append(np.asarray(rows)[diverse_exemplars(vectors, max_exemplars)])
+
+            color_prototypes.append(colors.mean(axis=0))
+            if embedded:
+                centroid_names.append(pet_id)
+                centroids.append(index.embeddings.matrix[embedded].mean(axis=0))
+
+        self.color_prototypes = normalize_rows(np.asarray(color_prototypes)) if color_prototypes \
+            else np.zeros((0, index.histograms.shape[1]), dtype=np.float32)
+        self.centroids = EmbeddingMatrix(centroid_names, centroids)
+        # Exact centroid search by default; may be replaced by an ANN index with the same interface
+        self.prototype_search = self.centroids
+        self.pet_row = {pet_id: i for i, pet_id in enumerate(self.pet_ids)}
+
+    def __len__(self):
+        return len(self.pet_ids)
+
+    def keys(self):
+        return self.index.embeddings.keys()
+
+    def color_candidates(self, query_corr, top_k):
+        """
+        Exemplar rows of the top_k pets with the closest colour prototype.
+
+        Args:
+            query_corr: the query histogram as a correlation row (see correlation_rows)
+
+        Returns (rows, color_sims) of the exemplar images, best colour first.
+        """
+        pet_sims = self.color_prototypes @ query_corr
+        pets = np.arange(len(pet_sims))
+        if 0 < top_k < len(pets):
+            pets = np.argpartition(-pet_sims, top_k - 1)[:top_k]
+        rows = np.concatenate([self.exemplar_rows[p] for p in pets]) if len(pets) else np.zeros(0, dtype=np.int64)
+        color_sims = self.index.histograms[rows] @ query_corr
+        order = np.argsort(-color_sims, kind='stable')
+        return rows[order], color_sims[order]
+
+    def search(self, query, k=5):
+        return self.search_batch(np.asarray(query)[None, :], k)[0]
+
+    def search_batch(self, queries, k=5):
+        """Top-k exemplar images as [(filename, cosine_similarity), ...], best first"""
+        queries = normalize_rows(np.asarray(queries))
+        results = []
+        for query, pets in zip(queries, self.prototype_search.search_batch(queries, k)):
+            fnames = [self.index.names[r] for pet_id, _ in pets for r in self.exemplar_rows[self.pet_row[pet_id]]]
+            fnames = [f for f in fnames if f in self.embedding_rows]
+            if not fnames:
+                results.append([])
+                continue
+            sims = self.index.embeddings.matrix[[self.embedding_rows[f] for f in fnames]] @ query
+            top = np.argsort(-sims, kind='stable')[:k]
+            results.append([(fnames[i], float(sims[i])) for i in top])
+        return results
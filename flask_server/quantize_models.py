@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Build INT8 versions of the CPU models and report their accuracy against the float models
+#
+# Post-training static quantization (onnx_models.quantize_onnx_model) of:
+#   classifier  the stray classifier, model.h5 (besttrial.py)
+#   embedder    the embedding backbone, EMBEDDING_BACKEND (besttrial.py)
+#   leash       the leash ResNet50, resnet.pth (new_stream.py)
+# Each model is exported to ONNX in --onnx-dir if needed and written next to
+# its export as <name>.int8.onnx, which INFERENCE_RUNTIME=onnx-int8
+# (besttrial.py) and LEASH_RUNTIME=onnx-int8 (new_stream.py) load.
+#
+# Activation ranges are calibrated on the crops the server saved in
+# venv/debug. A fixed share of the crops (--holdout, chosen by a hash of the
+# file path so it does not change between runs) is never used for
+# calibration; on those the INT8 model is compared with the float model:
+#   classifier  stray/not-stray decision agreement and mean score change
+#   embedder    mean and lowest cosine similarity, and how often each crop
+#               keeps the same nearest neighbour among the held-out crops
+#   leash       leash label agreement
+# plus the time per crop of both. The report is also written to
+# <onnx-dir>/quantization_report.json.
+#
+# Usage:
+#   python quantize_models.py
+#   python quantize_models.py --models classifier embedder --backend mobilenet_v3_small --method percentile
+
+import argparse
+import json
+import os
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from embedding_backends import BACKENDS, input_batch
+from onnx_models import OnnxModel, load_onnx_model, quantize_onnx_model
+from check_onnx_parity import STRAY_THRESHOLD, classifier_batch
+
+# new_stream.py's leash classifier input: 640x640 RGB, ImageNet mean/std normalized, NCHW
+LEASH_SIZE = 640
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def list_crops(directory):
+    paths = []
+    for root, _, files in sorted(os.walk(directory)):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return paths
+
+
+def split_crops(paths, directory, holdout):
+    """(calibration, held_out) paths; a crop's side depends only on its path"""
+    calibration, held_out = [], []
+    for path in paths:
+        bucket = zlib.crc32(os.path.relpath(path, directory).encode()) % 1000
+        (held_out if bucket < holdout * 1000 else calibration).append(path)
+    return calibration, held_out
+
+
+def read_crops(paths):
+    return [img for img in (cv2.imread(p) for p in paths) if img is not None]
+
+
+def leash_batch(crops):
+    batch = np.stack([cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (LEASH_SIZE, LEASH_SIZE))
+                      for img in crops]).astype(np.float32) / 255.0
+    return ((batch - IMAGENET_MEAN) / IMAGENET_STD).transpose(0, 3, 1, 2)
+
+
+def export_leash_model(resnet_path, onnx_path):
+    """Export new_stream.py's leash ResNet50 (2 classes) to ONNX with a dynamic batch axis"""
+    import torch
+    import torch.nn as nn
+    from torchvision import models
+
+    model = models.resnet50(weights=None)
+    model.fc = nn.Linear(in_features=2048, out_features=2)
+    model.load_state_dict(torch.load(resnet_path, map_location='cpu', weights_only=True))
+    model.eval()
+    os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+    tmp_path = f"{onnx_path}.tmp-{os.getpid()}"
+    torch.onnx.export(model, torch.zeros(1, 3, LEASH_SIZE, LEASH_SIZE), tmp_path, opset_version=13,
+                      input_names=['input'], output_names=['logits'],
+                      dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}})
+    os.replace(tmp_path, onnx_path)
+
+
+def batches(crops, prepare, batch_size):
+    for start in range(0, len(crops), batch_size):
+        yield prepare(crops[start:start + batch_size])
+
+
+def run(model, crops, prepare, batch_size):
+    """Outputs for all crops and the time per crop in ms"""
+    model.predict(prepare(crops[:1]))  # Warm-up
+    outputs, seconds = [], 0.0
+    for batch in batches(crops, prepare, batch_size):
+        start = time.perf_counter()
+        outputs.append(model.predict(batch))
+        seconds += time.perf_counter() - start
+    return np.vstack(outputs), seconds * 1000 / len(crops)
+
+
+def compare(kind, expected, actual):
+    if kind == 'classifier':
+        return {
+            'decision_agreement': float(np.mean((expected[:, 0] >= STRAY_THRESHOLD) == (actual[:, 0] >= STRAY_THRESHOLD))),
+            'mean_score_change': float(np.mean(np.abs(expected[:, 0] - actual[:, 0])))
+        }
+    if kind == 'leash':
+        return {'label_agreement': float(np.mean(np.argmax(expected, axis=1) == np.argmax(actual, axis=1)))}
+
+    def normalized(x):
+        return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-12)
+
+    expected, actual = normalized(expected), normalized(actual)
+    cosine = np.sum(expected * actual, axis=1)
+    neighbours = []
+    for vectors in (expected, actual):
+        sims = vectors @ vectors.T
+        np.fill_diagonal(sims, -np.inf)
+        neighbours.append(np.argmax(sims, axis=1))
+    return {
+        'mean_cosine': float(cosine.mean()),
+        'min_cosine': float(cosine.min()),
+        'nearest_neighbour_agreement': float(np.mean(neighbours[0] == neighbours[1])) if len(cosine) > 1 else 1.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="INT8 static quantization of the CPU models")
+    parser.add_argument('--models', nargs='+', default=['classifier', 'embedder', 'leash'],
+                        choices=['classifier', 'embedder', 'leash'])
+    parser.add_argument('--model', default="model.h5", help="Stray classifier Keras model")
+    parser.add_argument('--backend', default=os.getenv('EMBEDDING_BACKEND', 'resnet50'), choices=list(BACKENDS))
+    parser.add_argument('--resnet', default=os.getenv('RESNET_PATH', 'resnet.pth'), help="Leash classifier weights")
+    parser.add_argument('--onnx-dir', default=os.getenv('ONNX_MODEL_DIR', os.path.join("venv", "onnx")))
+    parser.add_argument('--images', default=os.path.join("venv", "debug"), help="Crops for calibration and evaluation")
+    parser.add_argument('--holdout', type=float, default=0.2, help="Share of crops kept out of calibration")
+    parser.add_argument('--calibration-limit', type=int, default=256, help="Most crops used for calibration")
+    parser.add_argument('--method', default='minmax', choices=['minmax', 'percentile', 'entropy'])
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime intra-op threads, 0 uses every core")
+    args = parser.parse_args()
+
+    calibration_paths, held_out_paths = split_crops(list_crops(args.images), args.images, args.holdout)
+    calibration = read_crops(calibration_paths[:args.calibration_limit])
+    held_out = read_crops(held_out_paths)
+    if not calibration or not held_out:
+        print(f"Need crops in {args.images} for both calibration and evaluation "
+              f"(found {len(calibration)} and {len(held_out)})")
+        return
+    print(f"Calibrating on {len(calibration)} crops, evaluating on {len(held_out)} held-out crops")
+
+    models = {}
+    if 'classifier' in args.models:
+        def load_classifier():
+            import tensorflow as tf
+            return tf.keras.models.load_model(args.model)
+        path = os.path.join(args.onnx_dir, "model.onnx")
+        load_onnx_model(path, load_classifier, args.threads, source_path=args.model)
+        models['classifier'] = (path, classifier_batch)
+    if 'embedder' in args.models:
+        path = os.path.join(args.onnx_dir, f"{args.backend}.onnx")
+        load_onnx_model(path, BACKENDS[args.backend], args.threads)
+        models['embedder'] = (path, lambda crops: input_batch(args.backend, crops))
+    if 'leash' in args.models:
+        path = os.path.join(args.onnx_dir, "leash_resnet50.onnx")
+        if not os.path.exists(path) or os.path.getmtime(args.resnet) > os.path.getmtime(path):
+            print(f"Exporting {args.resnet} to {path}")
+            export_leash_model(args.resnet, path)
+        models['leash'] = (path, leash_batch)
+
+    report = {'calibration_crops': len(calibration), 'held_out_crops': len(held_out), 'method': args.method, 'models': {}}
+    for kind, (path, prepare) in models.items():
+        int8_path = quantize_onnx_model(path, batches(calibration, prepare, args.batch_size), method=args.method)
+        expected, float_ms = run(OnnxModel(path, args.threads), held_out, prepare, args.batch_size)
+        actual, int8_ms = run(OnnxModel(int8_path, args.threads), held_out, prepare, args.batch_size)
+        result = {'path': int8_path, 'float_ms': float_ms, 'int8_ms': int8_ms,
+                  'speedup': float_ms / int8_ms if int8_ms else 0.0, **compare(kind, expected, actual)}
+        report['models'][kind] = result
+
+        metrics = ', '.join(f"{k} {v:.4f}" for k, v in result.items() if k not in ('path', 'float_ms', 'int8_ms', 'speedup'))
+        print(f"{kind:<12}{float_ms:>8.1f} -> {int8_ms:>6.1f} ms/crop ({result['speedup']:.2f}x)  {metrics}")
+
+    report_path = os.path.join(args.onnx_dir, "quantization_report.json")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+
+if __name__ == '__main__':
+    main()
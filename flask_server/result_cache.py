@@ -0,0 +1,129 @@
+"""
+Perceptual-hash cache of classification/match results for repeated crops.
+
+The same animal is detected many times a day from nearly identical angles.
+Crops are reduced to a 64-bit perceptual hash (pHash or dHash); a new crop
+whose hash is within `radius` bits of a cached one reuses that entry's
+result instead of re-running the stray classifier and the owner match.
+Entries expire after `ttl` seconds, the least recently used entry is evicted
+when the cache is full, and the whole cache is cleared whenever the owner
+index changes. Keys can carry a scope (the detected species, which selects
+the owner index partition), and crops only match entries of the same scope.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+HASH_SIZE = 8  # 8x8 bits -> 64-bit hashes
+
+
+def _bits_to_int(bits):
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+
+def dhash(img, hash_size=HASH_SIZE):
+    """Difference hash: sign of horizontal gradients on a (hash_size x hash_size + 1) thumbnail"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(img, hash_size=HASH_SIZE):
+    """DCT hash: low-frequency DCT coefficients of a 32x32 thumbnail compared to their median"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:hash_size, :hash_size]
+    return _bits_to_int(low > np.median(low))
+
+
+HASH_FUNCTIONS = {'phash': phash, 'dhash': dhash}
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class MatchResultCache:
+    """Bounded LRU of results keyed by perceptual hash, with near-duplicate lookup"""
+
+    def __init__(self, max_entries=512, ttl=600, radius=6, method='phash'):
+        """
+        Args:
+            max_entries: entries kept before the least recently used one is evicted
+            ttl: seconds an entry stays valid
+            radius: maximum Hamming distance between hashes treated as the same crop
+            method: 'phash' or 'dhash'
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.radius = radius
+        self.hash_fn = HASH_FUNCTIONS[method]
+        self.entries = OrderedDict()  # (scope, hash) -> (created, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Bumped by clear(), so results computed against an older owner index are not stored
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, img, scope=None):
+        """Cache key of a crop; only keys with the same scope are compared"""
+        return scope, self.hash_fn(img)
+
+    def get(self, key):
+        """Value of the closest live entry within `radius` of key, or None"""
+        now = time.time()
+        with self.lock:
+            expired = [k for k, (created, _) in self.entries.items() if now - created > self.ttl]
+            for k in expired:
+                del self.entries[k]
+
+            best_key, best_distance = None, self.radius + 1
+            if key in self.entries:
+                best_key, best_distance = key, 0
+            else:
+                scope, crop_hash = key
+                for k in self.entries:
+                    if k[0] != scope:
+                        continue
+                    distance = hamming(crop_hash, k[1])
+                    if distance < best_distance:
+                        best_key, best_distance = k, distance
+
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            self.hits += 1
+            return self.entries[best_key][1]
+
+    def put(self, key, value, generation=None):
+        """Store value under key; dropped if the cache was cleared since `generation` was read"""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry, e.g. after the owner index changed"""
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Test that a memory-mapped owner index file can be updated with registry changes
+#
+# Builds an index over a few generated registry images, saves it with
+# save_owner_index, maps it back with load_owner_index, adds one image and
+# applies it with update_owner_index, the path refresh_owner_index and a
+# restart with OWNER_INDEX_FILE take.
+#
+# Usage:
+#   python test_owner_index_file.py
+#   python -m pytest test_owner_index_file.py
+
+import os
+import sys
+import tempfile
+
+import cv2
+import numpy as np
+
+from owner_index import H_BINS, S_BINS, build_owner_index, update_owner_index
+from owner_index_file import load_owner_index, save_owner_index
+
+
+def write_image(path, seed):
+    rng = np.random.default_rng(seed)
+    img = np.zeros((240, 320, 3), dtype=np.uint8)
+    for _ in range(40):
+        x, y = (int(v) for v in rng.integers(0, 300, 2))
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cv2.rectangle(img, (x, y % 220), (x + 20, y % 220 + 20), color, -1)
+    cv2.imwrite(path, img)
+
+
+def test_update_mapped_index():
+    orb = cv2.ORB_create()
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, "registry")
+        os.makedirs(database_path)
+        for i in range(3):
+            write_image(os.path.join(database_path, f"pet{i}.jpg"), i)
+
+        index_path = os.path.join(tmp, "owner_index.bin")
+        save_owner_index(build_owner_index(database_path, orb), index_path)
+        mapped = load_owner_index(index_path)
+        assert len(mapped) == 3
+        assert all(entry['histogram'].shape == (H_BINS, S_BINS) for entry in mapped.entries.values())
+
+        write_image(os.path.join(database_path, "pet3.jpg"), 3)
+        updated, changes = update_owner_index(mapped, orb, min_age=0)
+        assert changes['added'] == ["pet3.jpg"]
+        assert len(updated) == 4
+
+        # Mapped (stored as correlation rows) and fresh histograms score the same way
+        fresh = build_owner_index(database_path, orb)
+        for fname in fresh.names:
+            row = fresh.histograms[fresh.names.index(fname)]
+            assert np.allclose(updated.histograms[updated.names.index(fname)], row, atol=1e-5)
+
+        # The updated index can be written and mapped again
+        save_owner_index(updated, index_path)
+        assert len(load_owner_index(index_path)) == 4
+
+
+if __name__ == '__main__':
+    test_update_mapped_index()
+    print("OK")
+    sys.exit(0)